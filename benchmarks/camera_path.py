@@ -0,0 +1,199 @@
+"""
+End to end benchmark of the SonySLTA58 driver against fake_gphoto2.py.
+
+    python -m benchmarks.camera_path --output results.json
+
+Measures connect time, overhead of single exposures over their exposure
+time, sustained throughput of an exposure sequence and peak RSS growth
+while a frame is taken. Results are written as JSON so they can be
+compared between releases.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.gphoto_latency import FAKE_GPHOTO
+from telescopy import metrics, settings
+
+
+class RssSampler:
+    """
+    Samples resident set size of this process in the background and
+    keeps the peak seen since the last reset.
+    """
+
+    INTERVAL = 0.005
+
+    def __init__(self):
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.INTERVAL)
+
+    def reset(self):
+        self.peak = self.rss()
+        return self.peak
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def call(handler, *args):
+    # run @non_blocking handlers synchronously, unwrap() follows
+    # __wrapped__ of the bound method to the plain function
+    return inspect.unwrap(handler.__func__)(handler.__self__, *args)
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": statistics.mean(values),
+        "median": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+def bench_connect(driver, const, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.monotonic()
+        call(driver.connect, None, const.SwitchState.ON)
+        timings.append(time.monotonic() - start)
+        if driver.general.connection.state_ != const.State.OK:
+            raise RuntimeError("Camera did not connect")
+        call(driver.connect, None, const.SwitchState.OFF)
+    return summary(timings)
+
+
+def bench_exposures(driver, const, exposure, frames, rss):
+    overheads = []
+    rss_growth = []
+    for _ in range(frames):
+        baseline = rss.reset()
+        start = time.monotonic()
+        call(driver.expose, None, exposure)
+        overheads.append(time.monotonic() - start - exposure)
+        rss_growth.append(rss.peak - baseline)
+        if driver.exposition.exposure.state_ != const.State.OK:
+            raise RuntimeError("Exposure failed")
+    return {
+        "overhead": summary(overheads),
+        "peak_rss_growth": summary(rss_growth),
+    }
+
+
+def bench_sequence(driver, const, exposure, frames):
+    driver.exposition.sequence_settings.count.value = frames
+    driver.exposition.sequence_settings.delay.value = 0
+    start = time.monotonic()
+    call(driver.expose_sequence, None, exposure)
+    elapsed = time.monotonic() - start
+    if driver.exposition.sequence.state_ != const.State.OK:
+        raise RuntimeError("Sequence failed")
+    return {
+        "frames": frames,
+        "elapsed": elapsed,
+        "frames_per_hour": frames * 3600 / elapsed,
+        "dead_time_per_frame": max(0, elapsed / frames - exposure),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="JSON file, stdout if not given")
+    parser.add_argument("--exposure", type=float, default=1)
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--connects", type=int, default=3)
+    parser.add_argument("--startup", type=float, default=1.5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--raw-size", type=int, default=25 * 1024 * 1024)
+    parser.add_argument("--jpeg-size", type=int, default=6 * 1024 * 1024)
+    parser.add_argument("--download-rate", type=float, default=20 * 1024 * 1024)
+    args = parser.parse_args()
+
+    fake = {
+        "startup": args.startup,
+        "latency": args.latency,
+        "raw_size": args.raw_size,
+        "jpeg_size": args.jpeg_size,
+        "download_rate": args.download_rate,
+        "time_scale": 1,
+    }
+
+    workdir = tempfile.mkdtemp(prefix="telescopy-bench-")
+    script = os.path.join(workdir, "fake_gphoto2.json")
+    with open(script, "w") as f:
+        json.dump(fake, f)
+    os.environ["FAKE_GPHOTO_SCRIPT"] = script
+
+    settings.GPHOTO_PATH = FAKE_GPHOTO
+    settings.PUB_DIR = os.path.join(workdir, "pub")
+    settings.STAGING_DIR = os.path.join(settings.PUB_DIR, ".staging")
+    settings.GPHOTO_CACHE_DIR = os.path.join(settings.PUB_DIR, ".cache", "gphoto")
+    os.makedirs(settings.PUB_DIR)
+
+    from indi.message import const
+    from indi.routing import Router
+    from telescopy.devices.SonySLTA58 import SonySLTA58
+
+    driver = SonySLTA58(router=Router())
+    rss = RssSampler()
+    try:
+        results = {
+            "connect": bench_connect(driver, const, args.connects),
+        }
+        call(driver.connect, None, const.SwitchState.ON)
+        results["exposure"] = bench_exposures(
+            driver, const, args.exposure, args.frames, rss
+        )
+        results["sequence"] = bench_sequence(driver, const, args.exposure, args.frames)
+        results["metrics"] = metrics.snapshot()
+        call(driver.connect, None, const.SwitchState.OFF)
+    finally:
+        rss.stop()
+        driver.postprocessor.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": time.time(),
+        "python": sys.version,
+        "machine": platform.machine(),
+        "args": vars(args),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
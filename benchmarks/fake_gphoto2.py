@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Stand-in for the gphoto2 binary, for running the camera path without
+a camera attached.
+
+Point `GPHOTO_PATH` at it:
+
+    GPHOTO_PATH="python /app/benchmarks/fake_gphoto2.py" python server.py
+
+Supports the subset of gphoto2 used by telescopy, both as one-shot
+command line options and in `--shell` mode. Behaviour is taken from the
+environment:
+
+    FAKE_GPHOTO_STARTUP        seconds spent opening the camera (per process)
+    FAKE_GPHOTO_LATENCY        seconds spent on every command round trip
+    FAKE_GPHOTO_FILE_SIZE      size in bytes of every captured file
+    FAKE_GPHOTO_RAW_SIZE       size in bytes of ARW files (FILE_SIZE if unset)
+    FAKE_GPHOTO_JPEG_SIZE      size in bytes of JPG files (FILE_SIZE if unset)
+    FAKE_GPHOTO_DOWNLOAD_RATE  download speed in bytes per second, 0 is instant
+    FAKE_GPHOTO_TIME_SCALE     factor applied to exposure times
+
+or from a JSON script named by FAKE_GPHOTO_SCRIPT, with the same keys in
+lower case without the prefix and an optional `commands` object mapping
+command names (e.g. "get-config") to their own latency.
+"""
+import json
+import os
+import sys
+import time
+
+
+def load_config():
+    file_size = int(os.environ.get("FAKE_GPHOTO_FILE_SIZE", 1024 * 1024))
+    config = {
+        "startup": float(os.environ.get("FAKE_GPHOTO_STARTUP", 1.5)),
+        "latency": float(os.environ.get("FAKE_GPHOTO_LATENCY", 0.02)),
+        "raw_size": int(os.environ.get("FAKE_GPHOTO_RAW_SIZE", file_size)),
+        "jpeg_size": int(os.environ.get("FAKE_GPHOTO_JPEG_SIZE", file_size)),
+        "download_rate": float(os.environ.get("FAKE_GPHOTO_DOWNLOAD_RATE", 0)),
+        "time_scale": float(os.environ.get("FAKE_GPHOTO_TIME_SCALE", 1)),
+        "commands": {},
+    }
+    script = os.environ.get("FAKE_GPHOTO_SCRIPT")
+    if script:
+        with open(script) as f:
+            config.update(json.load(f))
+    return config
+
+
+CONFIG = load_config()
+
+CHUNK = 1024 * 1024
+
+
+def command_latency(cmd):
+    time.sleep(CONFIG["commands"].get(cmd.lstrip("-"), CONFIG["latency"]))
+
+
+class Camera:
+    def __init__(self):
+        self.counter = 0
+        self.local_dir = os.getcwd()
+        self.config = {
+            "iso": ["Auto ISO", "Auto ISO Multi Frame Noise Reduction"]
+            + ["100", "200", "400", "800", "1600", "3200"],
+            "imagequality": ["RAW", "Standard", "Fine", "RAW+JPEG"],
+            "shutterspeed": ["1/4000", "1/1000", "1/250", "1/60", "1/15"]
+            + ["1/4", "1", "2", "4", "8", "15", "30", "Bulb"],
+            "capture": ["off", "on"],
+            "batterylevel": ["87%"],
+            "manufacturer": ["Sony Corporation"],
+            "cameramodel": ["SLT-A58"],
+            "deviceversion": ["1.0"],
+            "serialnumber": ["00000000000000003282933003146837"],
+        }
+        self.current = {
+            "iso": "100",
+            "imagequality": "RAW+JPEG",
+            "shutterspeed": "1/60",
+            "capture": "off",
+            "batterylevel": "87%",
+            "manufacturer": "Sony Corporation",
+            "cameramodel": "SLT-A58",
+            "deviceversion": "1.0",
+            "serialnumber": "00000000000000003282933003146837",
+        }
+
+    def get_config(self, name):
+        if name not in self.current:
+            return f"*** Error: {name} not found in configuration tree. ***\n"
+        lines = [
+            f"Label: {name}",
+            "Readonly: 0",
+            "Type: RADIO",
+            f"Current: {self.current[name]}",
+        ]
+        lines += [f"Choice: {i} {c}" for i, c in enumerate(self.config[name])]
+        lines += ["END"]
+        return "\n".join(lines) + "\n"
+
+    def set_config(self, arg):
+        name, value = arg.split("=", 1)
+        if name not in self.current:
+            return f"*** Error: {name} not found in configuration tree. ***\n"
+        self.current[name] = value
+        return ""
+
+    def set_config_index(self, arg):
+        name, index = arg.split("=", 1)
+        try:
+            self.current[name] = self.config[name][int(index)]
+        except (KeyError, IndexError, ValueError):
+            return f"*** Error: Cannot set {name} to index {index}. ***\n"
+        return ""
+
+    def exposure_time(self):
+        speed = self.current["shutterspeed"]
+        if "/" in speed:
+            numerator, denominator = speed.split("/")
+            return float(numerator) / float(denominator)
+        try:
+            return float(speed)
+        except ValueError:
+            return 0
+
+    def capture(self, filename=None):
+        time.sleep(self.exposure_time() * CONFIG["time_scale"])
+        return self.download(filename)
+
+    def download(self, filename=None):
+        self.counter += 1
+        output = ""
+        extensions = {
+            "RAW": ["ARW"],
+            "Standard": ["JPG"],
+            "Fine": ["JPG"],
+            "RAW+JPEG": ["ARW", "JPG"],
+        }[self.current["imagequality"]]
+        for ext in extensions:
+            name = f"DSC{self.counter:05d}.{ext}"
+            if filename:
+                name = filename.replace("%C", ext.lower())
+            size = CONFIG["raw_size"] if ext == "ARW" else CONFIG["jpeg_size"]
+            self.write_file(name, size)
+            output += f"Saving file as {name}\n"
+        return output
+
+    def write_file(self, name, size):
+        chunk = b"\xa5" * CHUNK
+        rate = CONFIG["download_rate"]
+        with open(os.path.join(self.local_dir, name), "wb") as f:
+            left = size
+            while left > 0:
+                written = min(left, CHUNK)
+                f.write(chunk[:written])
+                left -= written
+                if rate:
+                    time.sleep(written / rate)
+
+
+def run_shell(camera):
+    def prompt():
+        sys.stdout.write(f"gphoto2: {{{camera.local_dir}}} /> ")
+        sys.stdout.flush()
+
+    prompt()
+    for line in sys.stdin:
+        args = line.split()
+        if not args:
+            prompt()
+            continue
+        cmd, arg = args[0], " ".join(args[1:])
+        command_latency(cmd)
+        if cmd in ("exit", "quit", "q"):
+            return
+        elif cmd == "get-config":
+            sys.stdout.write(camera.get_config(arg))
+        elif cmd == "set-config":
+            sys.stdout.write(camera.set_config(arg))
+        elif cmd == "set-config-index":
+            sys.stdout.write(camera.set_config_index(arg))
+        elif cmd == "lcd":
+            camera.local_dir = arg
+        elif cmd == "capture-image-and-download":
+            sys.stdout.write(camera.capture())
+        elif cmd == "wait-event":
+            time.sleep(float(arg.rstrip("s")) * CONFIG["time_scale"])
+        elif cmd == "wait-event-and-download":
+            sys.stdout.write(camera.download())
+        else:
+            sys.stdout.write(f"*** Error: Unknown command {cmd} ***\n")
+        prompt()
+
+
+ACTIONS = (
+    "--get-config",
+    "--set-config",
+    "--set-config-index",
+    "--capture-image-and-download",
+    "--wait-event",
+    "--wait-event-and-download",
+)
+
+
+def run_once(camera, argv):
+    filename = None
+    for arg in argv:
+        if arg.startswith("--filename="):
+            filename = arg[len("--filename=") :]
+
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.split("=", 1)[0] in ACTIONS:
+            command_latency(arg.split("=", 1)[0])
+        if arg == "--get-config":
+            i += 1
+            sys.stdout.write(camera.get_config(argv[i]))
+        elif arg == "--set-config":
+            i += 1
+            sys.stdout.write(camera.set_config(argv[i]))
+        elif arg == "--set-config-index":
+            i += 1
+            sys.stdout.write(camera.set_config_index(argv[i]))
+        elif arg == "--capture-image-and-download":
+            sys.stdout.write(camera.capture(filename))
+        elif arg.startswith("--wait-event="):
+            time.sleep(float(arg.split("=", 1)[1].rstrip("s")) * CONFIG["time_scale"])
+        elif arg.startswith("--wait-event-and-download="):
+            sys.stdout.write(camera.download(filename))
+        i += 1
+
+
+def main(argv):
+    time.sleep(CONFIG["startup"])
+    camera = Camera()
+    if "--shell" in argv:
+        run_shell(camera)
+    else:
+        run_once(camera, argv)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+"""
+Round trip latency of camera config reads, one gphoto2 process per
+command versus a kept-alive gphoto2 shell.
+
+    python -m benchmarks.gphoto_latency [--gphoto "gphoto2"] [--count 10]
+
+Without a camera attached it runs against `fake_gphoto2.py`.
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from telescopy import settings
+from telescopy.devices.hardware.camera.Gphoto import Gphoto
+
+FAKE_GPHOTO = f"{sys.executable} {os.path.join(os.path.dirname(__file__), 'fake_gphoto2.py')}"
+
+
+def one_shot(model, count):
+    cmd = shlex.split(settings.GPHOTO_PATH) + [
+        f"--camera={model}",
+        "--quiet",
+        "--get-config",
+        "iso",
+    ]
+    timings = []
+    for _ in range(count):
+        start = time.monotonic()
+        subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        timings.append(time.monotonic() - start)
+    return timings
+
+
+def session(model, count):
+    gphoto = Gphoto(model)
+    start = time.monotonic()
+    gphoto.open()
+    startup = time.monotonic() - start
+    timings = []
+    try:
+        for _ in range(count):
+            start = time.monotonic()
+            gphoto.get_camera_config("iso", max_age=0)
+            timings.append(time.monotonic() - start)
+    finally:
+        gphoto.close()
+    return startup, timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(
+        f"{name:>10}: n={len(timings)}"
+        f" mean={sum(timings) / len(timings) * 1000:.1f}ms"
+        f" min={timings[0] * 1000:.1f}ms"
+        f" max={timings[-1] * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gphoto", default=FAKE_GPHOTO)
+    parser.add_argument("--model", default="Sony SLT-A58 (Control)")
+    parser.add_argument("--count", type=int, default=10)
+    args = parser.parse_args()
+
+    settings.GPHOTO_PATH = args.gphoto
+
+    report("one-shot", one_shot(args.model, args.count))
+    startup, timings = session(args.model, args.count)
+    print(f"   startup: {startup * 1000:.1f}ms")
+    report("session", timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,42 @@
 #!/usr/bin/env python
 
 import logging
-import threading
 from logging import config
 
-import telescopy.devices
 from indi.device.pool import DevicePool
 from indi.routing import Router
 from indi.transport.server import TCP as TCPServer
 from indi.transport.server import WebSocket as WebSocketServer
-from telescopy import settings
+from telescopy import devices, settings
 from telescopy.http import HttpServer
+from telescopy.retention import Retention
+from telescopy.runtime import Runtime
+from telescopy.supervisor import Supervisor
 
 router = Router()
 
 settings.LOGGING["handlers"]["indi"]["router"] = [router]
 config.dictConfig(settings.LOGGING)
 
+Runtime.start()
 
 
+
+devices.load()
+
 if settings.ENABLE_SIMULATORS:
     import telescopy_sims.devices
 
-HttpServer.start()
+HttpServer.setup()
+Supervisor.on_shutdown(HttpServer.stop)
 
 
 DevicePool.init(router)
+devices.report()
 
-tcp_server = TCPServer(router=router)
-ws_server = WebSocketServer(router=router)
-
-tcp_th = threading.Thread(target=tcp_server.start, daemon=True,)
-
-ws_th = threading.Thread(target=ws_server.start, daemon=True,)
-
-tcp_th.start()
-ws_th.start()
+Supervisor.add("http", HttpServer.http_server)
+Runtime.every(settings.STORAGE_CHECK_INTERVAL, Retention.enforce)
+Supervisor.add("tcp", lambda: TCPServer(router=router).start())
+Supervisor.add("websocket", lambda: WebSocketServer(router=router).start())
 
-while True:
-    pass
+Supervisor.run()
@@ -0,0 +1,246 @@
+import bisect
+import glob
+import logging
+import os
+import threading
+
+from . import settings
+from .postprocessing import PostProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """
+    In-memory index of frames published in PUB_DIR/<device>/.
+
+    The index is built once at startup and then kept up to date by the
+    drivers saving frames and the HTTP server deleting them, so queries
+    never touch the filesystem.
+
+    Frames all bytes of which were sent over HTTP, in one response or in
+    ranges, are flagged as downloaded. The flags are kept in
+    CATALOG_DOWNLOADS_FILE to survive restarts.
+    """
+
+    lock = threading.Lock()
+    entries = {}
+    # (mtime, path) of all entries, ascending
+    order = []
+    # sum of sizes of all entries
+    total_size = 0
+    # paths of downloaded entries
+    downloaded = set()
+    # path: merged [start, end) byte ranges sent of entries not downloaded yet
+    sent = {}
+
+    @classmethod
+    def rebuild(cls):
+        downloaded = cls._load_downloaded()
+        entries = {}
+        for device in cls._listdir(settings.PUB_DIR):
+            device_dir = os.path.join(settings.PUB_DIR, device)
+            if not os.path.isdir(device_dir):
+                continue
+            for name in cls._listdir(device_dir):
+                entry = cls._entry(os.path.join(device_dir, name))
+                if entry is not None:
+                    entry["downloaded"] = entry["path"] in downloaded
+                    entries[entry["path"]] = entry
+
+        with cls.lock:
+            cls.entries = entries
+            cls.order = sorted((e["mtime"], e["path"]) for e in entries.values())
+            cls.total_size = sum(e["size"] for e in entries.values())
+            cls.downloaded = downloaded & set(entries)
+            cls._store_downloaded()
+
+    @classmethod
+    def add(cls, file_path):
+        entry = cls._entry(file_path)
+        if entry is None:
+            return None
+        with cls.lock:
+            cls._remove(entry["path"])
+            cls.entries[entry["path"]] = entry
+            bisect.insort(cls.order, (entry["mtime"], entry["path"]))
+            cls.total_size += entry["size"]
+        return entry
+
+    @classmethod
+    def delete(cls, file_path):
+        """
+        Deletes a frame and, once no other file of the same exposure is
+        left, its post-processed derivatives. Returns False when there
+        was no such frame.
+        """
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            return False
+        cls.remove(file_path)
+
+        directory, file_name = os.path.split(file_path)
+        base_name = os.path.splitext(file_name)[0]
+        siblings = os.path.join(glob.escape(directory), glob.escape(base_name) + ".*")
+        if not glob.glob(siblings):
+            previews_dir = os.path.join(directory, PostProcessor.PREVIEWS_DIR)
+            for suffix in (".preview.jpg", ".thumb.jpg"):
+                try:
+                    os.unlink(os.path.join(previews_dir, base_name + suffix))
+                except OSError:
+                    pass
+        return True
+
+    @classmethod
+    def remove(cls, file_path):
+        with cls.lock:
+            return cls._remove(cls._rel_path(file_path))
+
+    @classmethod
+    def mark_sent(cls, file_path, start, end):
+        """
+        Records bytes [start, end) of a frame as sent, flagging it as
+        downloaded once all of its bytes were.
+        """
+        with cls.lock:
+            entry = cls.entries.get(cls._rel_path(file_path))
+            if entry is None or entry["downloaded"]:
+                return
+            merged = []
+            for range_start, range_end in sorted(
+                cls.sent.get(entry["path"], []) + [(start, end)]
+            ):
+                if merged and range_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_end)
+                else:
+                    merged.append([range_start, range_end])
+            if merged[0][0] > 0 or merged[0][1] < entry["size"]:
+                cls.sent[entry["path"]] = [tuple(r) for r in merged]
+                return
+            cls.sent.pop(entry["path"], None)
+            entry["downloaded"] = True
+            cls.downloaded.add(entry["path"])
+            try:
+                with open(settings.CATALOG_DOWNLOADS_FILE, "a") as f:
+                    f.write(entry["path"] + "\n")
+            except OSError as e:
+                logger.warning("Cannot record download of %s: %s", entry["path"], e)
+
+    @classmethod
+    def oldest(cls, downloaded=None):
+        """
+        Returns all entries oldest first, only the downloaded or only the not
+        downloaded ones when `downloaded` is given.
+        """
+        with cls.lock:
+            return [
+                cls.entries[path]
+                for _, path in cls.order
+                if downloaded is None or cls.entries[path]["downloaded"] == downloaded
+            ]
+
+    @classmethod
+    def get(cls, file_path):
+        with cls.lock:
+            return cls.entries.get(cls._rel_path(file_path))
+
+    @classmethod
+    def query(
+        cls,
+        device=None,
+        ext=None,
+        since=None,
+        until=None,
+        prefix=None,
+        offset=0,
+        limit=None,
+    ):
+        """
+        Returns (total, entries) of frames matching the filters, oldest first,
+        `since` and `until` being unix timestamps frames have to be modified
+        after and at latest, `prefix` the beginning of their file names.
+        """
+        with cls.lock:
+            start = 0
+            end = len(cls.order)
+            if since is not None:
+                start = bisect.bisect_right(cls.order, (since, "\uffff"))
+            if until is not None:
+                end = bisect.bisect_right(cls.order, (until, "\uffff"))
+            matching = [
+                cls.entries[path]
+                for _, path in cls.order[start:end]
+                if (device is None or cls.entries[path]["device"] == device)
+                and (ext is None or cls.entries[path]["ext"] == ext)
+                and (prefix is None or cls.entries[path]["name"].startswith(prefix))
+            ]
+        end = None if limit is None else offset + limit
+        return len(matching), matching[offset:end]
+
+    @classmethod
+    def _remove(cls, rel_path):
+        entry = cls.entries.pop(rel_path, None)
+        if entry is not None:
+            cls.total_size -= entry["size"]
+            cls.downloaded.discard(rel_path)
+            cls.sent.pop(rel_path, None)
+            i = bisect.bisect_left(cls.order, (entry["mtime"], rel_path))
+            if i < len(cls.order) and cls.order[i] == (entry["mtime"], rel_path):
+                del cls.order[i]
+        return entry
+
+    @classmethod
+    def _rel_path(cls, file_path):
+        return os.path.relpath(file_path, settings.PUB_DIR).replace(os.sep, "/")
+
+    @classmethod
+    def _entry(cls, file_path):
+        rel_path = cls._rel_path(file_path)
+        parts = rel_path.split("/")
+        if len(parts) != 2 or any(p.startswith(".") for p in parts):
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if not os.path.isfile(file_path):
+            return None
+        device, name = parts
+        return {
+            "path": rel_path,
+            "device": device,
+            "name": name,
+            "ext": os.path.splitext(name)[1][1:].lower(),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "url": settings.BASE_HTTP_URL + rel_path,
+            "downloaded": False,
+        }
+
+    @classmethod
+    def _load_downloaded(cls):
+        try:
+            with open(settings.CATALOG_DOWNLOADS_FILE) as f:
+                return set(line.strip() for line in f if line.strip())
+        except OSError:
+            return set()
+
+    @classmethod
+    def _store_downloaded(cls):
+        # called with the lock held, drops paths of deleted frames
+        downloads_file = settings.CATALOG_DOWNLOADS_FILE
+        try:
+            os.makedirs(os.path.dirname(downloads_file), exist_ok=True)
+            with open(downloads_file + ".tmp", "w") as f:
+                f.writelines(path + "\n" for path in sorted(cls.downloaded))
+            os.replace(downloads_file + ".tmp", downloads_file)
+        except OSError as e:
+            logger.warning("Cannot store downloaded frames: %s", e)
+
+    @classmethod
+    def _listdir(cls, path):
+        try:
+            return [name for name in os.listdir(path) if not name.startswith(".")]
+        except OSError:
+            return []
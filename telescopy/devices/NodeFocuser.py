@@ -1,22 +1,27 @@
 import logging
 import time
 
-from indi.device import Driver, non_blocking, properties
+from indi.device import Driver, properties
 from indi.device.pool import DevicePool
 from indi.message import const
 from telescopy import settings
+from telescopy.devices import TimedInit
 from telescopy.devices.hardware.focuser.NodeMCU import NodeMCU
+from telescopy.profiling import timed
+from telescopy.runtime import non_blocking, superseded
+from telescopy.throttle import PropertyThrottle
 
 logger = logging.getLogger(__name__)
 
 
 @DevicePool.register
-class NodeFocuser(Driver):
+class NodeFocuser(Driver, metaclass=TimedInit):
     name = "NODE_FOCUSER"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.focuser = NodeMCU(settings.FOCUSER_IP)
+        self.position_updates = PropertyThrottle("ABS_FOCUS_POSITION")
 
     general = properties.Group(
         "GENERAL",
@@ -52,6 +57,7 @@ class NodeFocuser(Driver):
     position.position.position.onwrite = "reposition"
 
     @non_blocking
+    @timed
     def connect(self, sender, value):
         connected = value == const.SwitchState.ON
         self.general.connection.state_ = const.State.BUSY
@@ -69,18 +75,26 @@ class NodeFocuser(Driver):
         self.position.enabled = connected
         self.general.info.enabled = connected
 
-    @non_blocking
+    @non_blocking(supersede=True)
+    @timed
     def reposition(self, sender, value):
         self.position.position.state_ = const.State.BUSY
         try:
             self.focuser.set_position(value, wait=False)
-            while (
-                abs(float(self.position.position.position.value) - float(value)) > 0.01
-            ):
+            # the published value may be held back by the throttle
+            position = float(self.focuser.get_position())
+            self.position_updates.set(self.position.position.position, position)
+            while abs(position - float(value)) > 0.01:
+                if superseded():
+                    # the newer call follows the focuser from now on
+                    return
                 time.sleep(1)
-                self.position.position.position.value = self.focuser.get_position()
+                position = float(self.focuser.get_position())
+                self.position_updates.set(self.position.position.position, position)
 
+            self.position_updates.flush()
             self.position.position.state_ = const.State.OK
         except Exception as e:
+            self.position_updates.flush()
             self.position.position.state_ = const.State.ALERT
             logger.error(e)
@@ -2,17 +2,22 @@ import json
 import logging
 import queue
 import socket
-import threading
 import time
 
 from indi.device import Driver, properties
 from indi.device.pool import DevicePool
 from indi.message import const
 from telescopy import settings
+from telescopy.devices import TimedInit
+from telescopy.profiling import timed
+from telescopy.runtime import Runtime
+from telescopy.supervisor import Supervisor
+
+logger = logging.getLogger(__name__)
 
 
 @DevicePool.register
-class PHD2(Driver):
+class PHD2(Driver, metaclass=TimedInit):
     name = "PHD2"
 
     general = properties.Group(
@@ -65,7 +70,9 @@ class PHD2(Driver):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.connection = self.Connection(self)
+        Supervisor.on_shutdown(self.connection.close)
 
+    @timed
     def connect(self, sender, **kwargs):
         if self.general.connection.connect.bool_value:
             self.connection.connect()
@@ -75,6 +82,7 @@ class PHD2(Driver):
             self.general.info.enabled = False
             self.dithering.enabled = False
 
+    @timed
     def dither(self, sender, value, **kwargs):
         self.dithering.dither.dither.value = value
         amount = float(self.dithering.dither.dither.value)
@@ -139,9 +147,9 @@ class PHD2(Driver):
                     if hasattr(self.device, method):
                         getattr(self.device, method)(**msg)
                     else:
-                        print(msg)
+                        logger.debug("PHD2: unhandled event: %s", msg)
                 if "jsonrpc" in msg:
-                    print(msg)
+                    logger.debug("PHD2: got response: %s", msg)
                     if msg["id"] in self.connection.rpc_responses:
                         self.connection.rpc_responses[msg["id"]].put(msg)
 
@@ -152,16 +160,10 @@ class PHD2(Driver):
             self.rpc_serial = 0
             self.rpc_responses = {}
 
-        def handle_incoming_messages(self):
-            while True:
-                logging.debug(f"PHD2: waiting for data")
-                message = self.sock.recv(1024)
-                if not message:
-                    logging.debug(f"PHD2: no data, breaking")
-                    break
-                logging.debug(f"PHD2: got data: {message}")
-                self.buffer.append(message.decode("latin1"))
-                self.buffer.process()
+        def handle_incoming_data(self, message):
+            logger.debug("PHD2: got data: %s", message)
+            self.buffer.append(message.decode("latin1"))
+            self.buffer.process()
 
         def rpc(self, method, params, response_timeout=30):
             self.rpc_serial += 1
@@ -174,7 +176,7 @@ class PHD2(Driver):
             q = queue.Queue()
             self.rpc_responses[id] = q
             payload_raw = json.dumps(payload) + "\r\n"
-            print(payload_raw)
+            logger.debug("PHD2: sending: %s", payload_raw)
             self.sock.sendall(payload_raw.encode("latin1"))
             try:
                 response = q.get(timeout=response_timeout)
@@ -193,13 +195,19 @@ class PHD2(Driver):
 
             raise Exception(f"Invalid JSONRPC response for request id={id}")
 
+        def close(self):
+            if self.sock is not None:
+                # wakes up the reader with an end of stream
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.sock.close()
+
         def connect(self):
             ip = self.device.general.connection_settings.ip.value
             port = int(self.device.general.connection_settings.port.value)
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((ip, port))
 
-            handler_thread = threading.Thread(
-                target=self.handle_incoming_messages, daemon=True,
-            )
-            handler_thread.start()
+            Runtime.read(self.sock, self.handle_incoming_data, size=1024)
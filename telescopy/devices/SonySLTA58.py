@@ -1,29 +1,54 @@
 import datetime
 import logging
 import os
+import queue
 import threading
 import time
 
-from indi.device import Driver, non_blocking, properties
+from indi.device import Driver, properties
 from indi.device.pool import DevicePool
 from indi.message import const
-from telescopy import settings
+from telescopy import metrics, settings
+from telescopy.catalog import Catalog
+from telescopy.devices import TimedInit
 from telescopy.devices.hardware.camera.SonySLTA58 import \
     SonySLTA58 as SonySLTA58_hw
+from telescopy.feed import FrameFeed
+from telescopy.postprocessing import PostProcessor
+from telescopy.profiling import timed
+from telescopy.retention import Retention
+from telescopy.runtime import Runtime, non_blocking
+from telescopy.supervisor import Supervisor
+from telescopy.throttle import PropertyThrottle
 
 logger = logging.getLogger(__name__)
 
 
 @DevicePool.register
-class SonySLTA58(Driver):
+class SonySLTA58(Driver, metaclass=TimedInit):
     name = "SONY_SLT_A58"
 
     BATTERY_CHECK_INTERVAL = 300
 
+    EXPOSURE_PHASES = (
+        "queue",
+        "startup",
+        "set_speed",
+        "capture",
+        "download",
+        "save",
+        "publish",
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.camera = SonySLTA58_hw()
         self.battcheck = None
+        self.sequence_stop = threading.Event()
+        self.postprocessor = PostProcessor()
+        self.info_updates = PropertyThrottle("INFO")
+        Supervisor.on_shutdown(self.shutdown)
+        Supervisor.on_shutdown(self.postprocessor.shutdown)
 
     general = properties.Group(
         "GENERAL",
@@ -76,9 +101,56 @@ class SonySLTA58(Driver):
     exposition = properties.Group(
         "EXPOSITION",
         enabled=False,
-        vectors=dict(exposure=properties.Standard("CCD_EXPOSURE")),
+        vectors=dict(
+            exposure=properties.Standard("CCD_EXPOSURE"),
+            sequence=properties.NumberVector(
+                "SEQUENCE_EXPOSURE",
+                elements=dict(
+                    time=properties.Number(
+                        "EXPOSURE_TIME", default=1, onwrite="expose_sequence"
+                    ),
+                ),
+            ),
+            sequence_settings=properties.NumberVector(
+                "SEQUENCE_SETTINGS",
+                elements=dict(
+                    count=properties.Number("COUNT", default=10),
+                    delay=properties.Number("DELAY", default=0),
+                ),
+            ),
+            sequence_abort=properties.SwitchVector(
+                "SEQUENCE_ABORT",
+                rule=properties.SwitchVector.RULES.ONE_OF_MANY,
+                elements=dict(abort=properties.Switch("ABORT")),
+            ),
+            timings=properties.NumberVector(
+                "EXPOSURE_TIMINGS",
+                perm=const.Permissions.READ_ONLY,
+                elements=dict(
+                    queue=properties.Number("QUEUE", default=0),
+                    startup=properties.Number("STARTUP", default=0),
+                    set_speed=properties.Number("SET_SPEED", default=0),
+                    capture=properties.Number("CAPTURE", default=0),
+                    download=properties.Number("DOWNLOAD", default=0),
+                    save=properties.Number("SAVE", default=0),
+                    publish=properties.Number("PUBLISH", default=0),
+                    total=properties.Number("TOTAL", default=0),
+                ),
+            ),
+            sequence_status=properties.NumberVector(
+                "SEQUENCE_STATUS",
+                perm=const.Permissions.READ_ONLY,
+                elements=dict(
+                    done=properties.Number("FRAMES_DONE", default=0),
+                    left=properties.Number("FRAMES_LEFT", default=0),
+                    rate=properties.Number("FRAMES_PER_HOUR", default=0),
+                    dead_time=properties.Number("DEAD_TIME", default=0),
+                ),
+            ),
+        ),
     )
     exposition.exposure.time.onwrite = "expose"
+    exposition.sequence_abort.abort.onwrite = "abort_sequence"
 
     images = properties.Group(
         "IMAGES",
@@ -88,60 +160,73 @@ class SonySLTA58(Driver):
                 "LAST_IMAGE_URL",
                 perm=const.Permissions.READ_ONLY,
                 elements=dict(arw=properties.Text("RAW"), jpg=properties.Text("JPEG"),),
-            )
+            ),
+            last_preview_url=properties.TextVector(
+                "LAST_PREVIEW_URL",
+                perm=const.Permissions.READ_ONLY,
+                elements=dict(
+                    preview=properties.Text("PREVIEW"),
+                    thumbnail=properties.Text("THUMBNAIL"),
+                ),
+            ),
+            last_stats=properties.NumberVector(
+                "LAST_IMAGE_STATS",
+                perm=const.Permissions.READ_ONLY,
+                elements=dict(
+                    mean=properties.Number("MEAN", default=0),
+                    stddev=properties.Number("STDDEV", default=0),
+                    min=properties.Number("MIN", default=0),
+                    max=properties.Number("MAX", default=0),
+                ),
+            ),
         ),
     )
 
     @non_blocking
+    @timed
     def connect(self, sender, value):
         self.general.connection.state_ = const.State.BUSY
         connected = value == const.SwitchState.ON
         if connected:
             try:
                 try:
-                    self.settings.iso.reset_selected_value(self.camera.get_iso())
+                    self.camera.connect()
                 except Exception:
-                    logger.error(
-                        "Cannot read iso setting from camera", extra={"device": self}
-                    )
+                    logger.error("Cannot open camera session", extra={"device": self})
                     raise
 
                 try:
-                    quality = self.camera.get_format()
-                    self.settings.quality.compress.reset_bool_value("jpeg" in quality)
-                    self.settings.quality.raw.reset_bool_value("raw" in quality)
+                    info = self.camera.get_info()
                 except Exception:
-                    logger.error("Cannot read quality setting from camera")
-                    raise
-
-                try:
-                    self.general.info.manufacturer.value = (
-                        self.camera.get_manufacturer()
-                    )
-                    self.general.info.camera_model.value = (
-                        self.camera.get_camera_model()
-                    )
-                    self.general.info.device_version.value = (
-                        self.camera.get_device_version()
-                    )
-                    self.general.info.serial_number.value = (
-                        self.camera.get_serial_number()
+                    logger.error(
+                        "Cannot read settings and properties from camera",
+                        extra={"device": self},
                     )
-                except Exception:
-                    logger.error("Cannot read properties from camera")
                     raise
 
-                if self.battcheck is None or not self.battcheck.is_alive():
-                    self.battcheck = threading.Thread(
-                        target=self.get_battery_level, daemon=True
+                self.settings.iso.reset_selected_value(info["iso"])
+                self.settings.quality.compress.reset_bool_value(info["format"]["jpeg"])
+                self.settings.quality.raw.reset_bool_value(info["format"]["raw"])
+                self.general.info.manufacturer.value = info["manufacturer"]
+                self.general.info.camera_model.value = info["camera_model"]
+                self.general.info.device_version.value = info["device_version"]
+                self.general.info.serial_number.value = info["serial_number"]
+
+                if self.battcheck is None or self.battcheck.done():
+                    self.battcheck = Runtime.every(
+                        self.BATTERY_CHECK_INTERVAL,
+                        self.get_battery_level,
+                        condition=lambda: self.general.connection.connect.bool_value,
                     )
-                    self.battcheck.start()
 
                 self.general.connection.state_ = const.State.OK
             except Exception:
                 connected = False
                 self.general.connection.state_ = const.State.ALERT
 
+        if not connected:
+            self.camera.disconnect()
+
         self.general.connection.connect.bool_value = connected
         self.general.info.enabled = connected
         self.exposition.enabled = connected
@@ -149,38 +234,166 @@ class SonySLTA58(Driver):
         self.images.enabled = connected
 
     @non_blocking
+    @timed
     def expose(self, sender, value):
         self.exposition.exposure.state_ = const.State.BUSY
         try:
+            Retention.reserve()
+            timer = metrics.PhaseTimer("exposure")
             file_name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
             self.exposition.exposure.time.value = value
-            imgs = self.camera.expose(float(value))
+            imgs = self.camera.expose(
+                float(value), staging_dir=settings.STAGING_DIR, timer=timer
+            )
+            self.save_images(file_name, imgs, exposure=float(value), timer=timer)
+            self.publish_timings(timer)
+            self.exposition.exposure.state_ = const.State.OK
+        except Exception as e:
+            logger.error("Exposure failed: %s", e, extra={"device": self})
+            self.exposition.exposure.state_ = const.State.ALERT
+
+    @non_blocking
+    def expose_sequence(self, sender, value):
+        sequence = self.exposition.sequence
+        status = self.exposition.sequence_status
+        sequence.state_ = const.State.BUSY
+        self.sequence_stop.clear()
+
+        sequence.time.value = value
+        exposure = float(value)
+        count = int(float(self.exposition.sequence_settings.count.value))
+        delay = float(self.exposition.sequence_settings.delay.value)
+
+        status.done.value = 0
+        status.left.value = count
+        status.rate.value = 0
+        status.dead_time.value = 0
+
+        # frames are saved and published by a separate thread,
+        # while the camera is already integrating the next one
+        saving = queue.Queue()
+        saver = Runtime.submit(self.save_queued_images, saving)
+
+        try:
+            Retention.reserve()
+            frames = self.camera.expose_sequence(
+                exposure,
+                count,
+                staging_dir=settings.STAGING_DIR,
+                delay=delay,
+                stop=self.sequence_stop,
+            )
+            try:
+                started = previous = time.monotonic()
+                for done, imgs in enumerate(frames, 1):
+                    now = time.monotonic()
+                    file_name = datetime.datetime.now().strftime(
+                        "%Y-%m-%d_%H-%M-%S-%f"
+                    )
+                    saving.put((file_name, imgs, exposure))
+
+                    status.done.value = done
+                    status.left.value = count - done
+                    status.rate.value = round(done * 3600 / (now - started), 1)
+                    status.dead_time.value = round(
+                        max(0, now - previous - exposure - delay), 3
+                    )
+                    previous = now
+
+                    if self.sequence_stop.is_set():
+                        # the next frame is only partly integrated,
+                        # it is abandoned rather than waited for
+                        break
+                    # the next frame is being taken already,
+                    # make room for it and the one after
+                    if done < count:
+                        Retention.reserve(frames=2)
+            finally:
+                frames.close()
+            sequence.state_ = const.State.OK
+        except Exception as e:
+            logger.error("Exposure sequence failed: %s", e, extra={"device": self})
+            sequence.state_ = const.State.ALERT
+        finally:
+            saving.put(None)
+            saver.result()
 
+    def shutdown(self):
+        # a frame being taken could not finish in time, it is abandoned
+        self.sequence_stop.set()
+        self.camera.abort()
+        self.camera.disconnect()
+
+    def abort_sequence(self, sender, value):
+        if value == const.SwitchState.ON:
+            self.sequence_stop.set()
+
+    def save_queued_images(self, saving):
+        while True:
+            item = saving.get()
+            if item is None:
+                return
+            file_name, imgs, exposure = item
+            try:
+                self.save_images(file_name, imgs, exposure=exposure)
+            except Exception as e:
+                logger.error("Cannot save %s: %s", file_name, e, extra={"device": self})
+
+    def save_images(self, file_name, imgs, exposure=None, timer=None):
+        timer = timer or metrics.PhaseTimer()
+        try:
             if self.settings.upload_mode.selected_value in (
                 "UPLOAD_LOCAL",
                 "UPLOAD_BOTH",
             ):
                 save_dir = os.path.join(settings.PUB_DIR, self.name)
-                if not os.path.exists(save_dir):
-                    os.mkdir(save_dir)
-
-                for ext, data in imgs.items():
-                    rel_path = os.path.join(self.name, f"{file_name}.{ext}")
-                    file_path = os.path.join(save_dir, f"{file_name}.{ext}")
-                    if os.path.exists(file_path):
-                        os.unlink(file_path)
-                    with open(file_path, mode="wb") as f:
-                        f.write(data)
-
-                    getattr(self.images.last_url, ext).value = (
-                        settings.BASE_HTTP_URL + rel_path
-                    )
-        except Exception:
-            self.exposition.exposure.state_ = const.State.ALERT
 
-        self.exposition.exposure.state_ = const.State.OK
+                saved = {}
+                with timer.phase("save"):
+                    if not os.path.exists(save_dir):
+                        os.mkdir(save_dir)
 
-    @non_blocking
+                    for ext, path in imgs.items():
+                        file_path = os.path.join(save_dir, f"{file_name}.{ext}")
+                        # staging dir is on the same filesystem, so this is
+                        # an atomic rename and no data is copied
+                        os.replace(path, file_path)
+                        saved[ext] = file_path
+                        entry = Catalog.add(file_path)
+                        if entry is not None:
+                            FrameFeed.publish(entry, exposure=exposure)
+
+                with timer.phase("publish"):
+                    for ext in saved:
+                        rel_path = os.path.join(self.name, f"{file_name}.{ext}")
+                        getattr(self.images.last_url, ext).value = (
+                            settings.BASE_HTTP_URL + rel_path
+                        )
+
+                    source = saved.get("jpg") or saved.get("arw")
+                    if source:
+                        self.postprocessor.submit(source, self.postprocessed)
+        finally:
+            self.camera.discard(imgs)
+
+    def publish_timings(self, timer):
+        total = timer.total()
+        metrics.histogram("exposure.total").observe(total)
+        for phase in self.EXPOSURE_PHASES:
+            getattr(self.exposition.timings, phase).value = round(
+                timer.phases.get(phase, 0), 3
+            )
+        self.exposition.timings.total.value = round(total, 3)
+
+    def postprocessed(self, result):
+        self.images.last_preview_url.preview.value = result["preview_url"]
+        self.images.last_preview_url.thumbnail.value = result["thumbnail_url"]
+        self.images.last_stats.mean.value = round(result["mean"], 2)
+        self.images.last_stats.stddev.value = round(result["stddev"], 2)
+        self.images.last_stats.min.value = result["min"]
+        self.images.last_stats.max.value = result["max"]
+
+    @non_blocking(supersede=True)
     def iso_changed(self, sender, **kwargs):
         self.settings.iso.state_ = const.State.BUSY
         try:
@@ -190,17 +403,30 @@ class SonySLTA58(Driver):
             self.settings.iso.state_ = const.State.ALERT
 
     def get_battery_level(self):
-        while self.general.connection.connect.bool_value:
-            self.general.info.state_ = const.State.BUSY
-            try:
-                self.general.info.battery_level.value = self.camera.get_battery_level()
-                self.general.info.state_ = const.State.OK
-            except:
-                self.general.info.battery_level.value = "ERROR"
-                self.general.info.state_ = const.State.ALERT
-            time.sleep(self.BATTERY_CHECK_INTERVAL)
+        # polled in the background, only changes are sent to clients
+        info = self.general.info
+        try:
+            status = self.camera.get_status()
+            self.info_updates.set(info.battery_level, status["battery_level"])
+            self.info_updates.flush()
+            if info.state_ != const.State.OK:
+                info.state_ = const.State.OK
+        except:
+            self.info_updates.set(info.battery_level, "ERROR")
+            self.info_updates.flush()
+            if info.state_ != const.State.ALERT:
+                info.state_ = const.State.ALERT
+        else:
+            # pick up changes made with the dials on the camera body
+            if self.settings.iso.state_ != const.State.BUSY:
+                self.settings.iso.reset_selected_value(status["iso"])
+            if self.settings.quality.state_ != const.State.BUSY:
+                self.settings.quality.compress.reset_bool_value(
+                    status["format"]["jpeg"]
+                )
+                self.settings.quality.raw.reset_bool_value(status["format"]["raw"])
 
-    @non_blocking
+    @non_blocking(supersede=True)
     def quality_changed(self, sender, **kwargs):
         self.settings.quality.state_ = const.State.BUSY
         try:
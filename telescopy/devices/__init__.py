@@ -1,6 +1,72 @@
-from .NodeFocuser import NodeFocuser
-from .PHD2 import PHD2
-from .SonySLTA58 import SonySLTA58
+import importlib
+import logging
+import time
 
-# from .Controller import Controller
-# from .Proxy import OneProxy
+from indi.device import Driver
+from telescopy import metrics, settings
+
+logger = logging.getLogger(__name__)
+
+# Driver classes by name and the modules defining them. Modules register
+# their drivers in the DevicePool when imported, so only drivers enabled
+# in settings.DRIVERS are imported, by load().
+DRIVERS = {
+    "NodeFocuser": ".NodeFocuser",
+    "PHD2": ".PHD2",
+    "SonySLTA58": ".SonySLTA58",
+    # "Controller": ".Controller",
+    # "OneProxy": ".Proxy",
+}
+
+# import and init seconds of loaded drivers
+timings = {}
+
+
+def load(names=None):
+    for name in settings.DRIVERS if names is None else names:
+        if name in timings:
+            continue
+        if name not in DRIVERS:
+            logger.error("Unknown driver %s", name)
+            continue
+
+        start = time.monotonic()
+        try:
+            importlib.import_module(DRIVERS[name], __name__)
+        except Exception as e:
+            # a broken driver must not keep the others from starting
+            logger.error("Cannot load driver %s: %s", name, e)
+            continue
+        timing = timings.setdefault(name, {"import": None, "init": None})
+        timing["import"] = time.monotonic() - start
+        metrics.histogram(f"driver.import.{name}").observe(timing["import"])
+
+
+def report():
+    for name, timing in timings.items():
+        logger.info(
+            "Driver %s: import %s, init %s",
+            name,
+            _seconds(timing["import"]),
+            _seconds(timing["init"]),
+        )
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.3f} s"
+
+
+class TimedInit(type(Driver)):
+    """
+    Metaclass of drivers recording how long constructing each one takes,
+    from the driver's own __init__ down to Driver.__init__.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            timing = timings.setdefault(cls.__name__, {"import": None, "init": None})
+            timing["init"] = time.monotonic() - start
+            metrics.histogram(f"driver.init.{cls.__name__}").observe(timing["init"])
@@ -1,62 +1,466 @@
+import collections
+import concurrent.futures
+import contextlib
+import json
+import logging
 import os
+import re
+import selectors
+import shlex
+import subprocess
 import threading
+import time
 
-from telescopy import settings
+from telescopy import metrics, settings
+
+logger = logging.getLogger(__name__)
 
 
 class GphotoException(Exception):
     pass
 
 
-class Gphoto:
+class GphotoSession:
+    """
+    Long-lived `gphoto2 --shell` child process.
+
+    The camera is opened once when the shell starts and stays open
+    between commands, so every command costs a single round trip
+    instead of a process start and USB re-enumeration.
+    """
+
+    PROMPT = re.compile(rb"gphoto2: \{[^}\n]*\} [^\n]*?> ")
+    ERROR = "*** Error"
+
     def __init__(self, model):
         self.model = model
-        self.lock = threading.Lock()
+        self.process = None
+        self.started = None
+        self.buffer = b""
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.stop()
+        cmd = shlex.split(settings.GPHOTO_PATH) + [
+            f"--camera={self.model}",
+            "--quiet",
+            "--shell",
+        ]
+        logger.debug("Starting gphoto session: %s", cmd)
+        try:
+            self.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,
+            )
+        except OSError as e:
+            self.process = None
+            raise GphotoException(f"Cannot start gphoto shell ({cmd}): {e}")
+        self.started = time.monotonic()
+        self.buffer = b""
+        self._read_until_prompt(settings.GPHOTO_TIMEOUT)
+
+    def stop(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            if process.poll() is None:
+                process.stdin.write(b"exit\n")
+                process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            process.stdin.close()
+            process.stdout.close()
+
+    def interrupt(self):
+        """
+        Kills the shell from any thread, abandoning the commands it is
+        running. The thread waiting for their output gets a
+        GphotoException.
+        """
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def kill(self):
+        """
+        Stops the shell at once, abandoning the commands it is running.
+        """
+        self.interrupt()
+        self.stop()
+
+    def execute(self, cmd, timeout=None):
+        return self.execute_many([cmd], timeout=timeout)[0]
+
+    def execute_many(self, cmds, timeout=None):
+        """
+        Writes all commands at once and collects one output per command,
+        so a batch costs a single round trip to the camera.
+        """
+        self.send(cmds)
+        return self.receive(len(cmds), timeout=timeout)
 
-    def exec_gphoto(self, cmd):
-        gphoto_bin = settings.GPHOTO_PATH
-        full_cmd = f'{gphoto_bin} --camera="{self.model}" --quiet {cmd}'
+    def send(self, cmds):
+        if not self.is_alive():
+            raise GphotoException("gphoto shell is not running")
         try:
-            self.lock.acquire()
+            self.process.stdin.write("".join(f"{cmd}\n" for cmd in cmds).encode())
+        except OSError as e:
+            self.stop()
+            raise GphotoException(f"Cannot write to gphoto shell: {e}")
+
+    def receive(self, count, timeout=None):
+        return [
+            self._read_until_prompt(timeout or settings.GPHOTO_TIMEOUT)
+            for _ in range(count)
+        ]
+
+    def _read_until_prompt(self, timeout):
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                match = self.PROMPT.search(self.buffer)
+                if match:
+                    output = self.buffer[: match.start()]
+                    self.buffer = self.buffer[match.end() :]
+                    return output.decode(errors="replace")
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    self.stop()
+                    raise GphotoException("Timeout waiting for gphoto shell")
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.stop()
+                    raise GphotoException("gphoto shell exited unexpectedly")
+                self.buffer += chunk
+
+
+class GphotoScheduler:
+    """
+    Hands out exclusive use of the gphoto session in priority order.
+
+    Waiters are served captures first, then setting changes, then
+    housekeeping. Housekeeping is held back for as long as an exposure
+    is in progress, even between its commands.
+    """
+
+    CAPTURE = 0
+    SETTING = 1
+    HOUSEKEEPING = 2
+
+    NAMES = {CAPTURE: "capture", SETTING: "setting", HOUSEKEEPING: "housekeeping"}
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.waiting = {priority: collections.deque() for priority in self.NAMES}
+        self.busy = False
+        self.exposures = 0
+
+    @contextlib.contextmanager
+    def slot(self, priority):
+        ticket = object()
+        enqueued = time.monotonic()
+        with self.condition:
+            self.waiting[priority].append(ticket)
+            while self.busy or self._next() is not ticket:
+                self.condition.wait()
+            self.waiting[priority].popleft()
+            self.busy = True
+
+        waited = time.monotonic() - enqueued
+        metrics.histogram(f"gphoto.queue_wait.{self.NAMES[priority]}").observe(waited)
+        try:
+            yield waited
+        finally:
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def exposure(self):
+        with self.condition:
+            self.exposures += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.exposures -= 1
+                self.condition.notify_all()
+
+    def _next(self):
+        for priority in sorted(self.waiting):
+            if priority == self.HOUSEKEEPING and self.exposures:
+                continue
+            if self.waiting[priority]:
+                return self.waiting[priority][0]
+        return None
+
+
+class Gphoto:
+    CAPTURE = GphotoScheduler.CAPTURE
+    SETTING = GphotoScheduler.SETTING
+    HOUSEKEEPING = GphotoScheduler.HOUSEKEEPING
+
+    def __init__(self, model):
+        self.model = model
+        self.scheduler = GphotoScheduler()
+        self.session = GphotoSession(model)
+        self.cache = {}
+        self.choices = {}
+        self.reads_lock = threading.Lock()
+        self.pending_reads = {}
+
+    def open(self):
+        with self.scheduler.slot(self.SETTING):
+            self.invalidate_cache()
+            self.session.start()
+
+    def close(self):
+        with self.scheduler.slot(self.SETTING):
+            self.session.stop()
+
+    def abort(self):
+        """
+        Kills the shell when a command is running, so close() does not
+        wait for it, e.g. for an exposure to end.
+        """
+        if self.scheduler.busy:
+            self.session.interrupt()
+
+    def exposure(self):
+        return self.scheduler.exposure()
+
+    @contextlib.contextmanager
+    def reserve(self, priority=SETTING, timer=None):
+        """
+        Holds the session for a series of commands, yielding a function
+        that runs one command and returns its output.
+
+        Time spent waiting in the queue and starting gphoto is added to
+        the `queue` and `startup` phases of `timer`.
+        """
+        with self.scheduler.slot(priority) as waited:
+            if timer is not None:
+                timer.add("queue", waited)
+            started = self._ensure_session()
+            if timer is not None and started is not None:
+                timer.add("startup", started)
+
+            def run(cmd, timeout=None):
+                output = self.session.execute(cmd, timeout=timeout)
+                self._check_output(cmd, output)
+                return output
+
+            yield run
+
+    def exec_gphoto(self, *cmds, timeout=None, priority=SETTING):
+        with self.reserve(priority) as run:
+            return "".join(run(cmd, timeout=timeout) for cmd in cmds)
+
+    def exec_gphoto_batch(self, cmds, timeout=None, priority=SETTING):
+        with self.scheduler.slot(priority):
+            self._ensure_session()
+            return self.session.execute_many(cmds, timeout=timeout)
+
+    def exec_gphoto_pipelined(self, batches, timeout=None, priority=CAPTURE):
+        """
+        Runs batches of commands keeping the next batch queued in the shell,
+        so gphoto starts on it while the caller handles the current output.
+
+        Yields the output of every batch in order. When the caller stops
+        early the batch already queued is abandoned by killing the shell,
+        which is started again on next use, instead of waiting for it.
+        """
+        with self.scheduler.slot(priority):
+            self._ensure_session()
+            batches = iter(batches)
+            pending = collections.deque()
+
+            def send_next():
+                cmds = next(batches, None)
+                if cmds is not None:
+                    self.session.send(cmds)
+                    pending.append(cmds)
+
             try:
-                f = os.popen(full_cmd)
-                result = f.read()
+                send_next()
+                while pending:
+                    send_next()
+                    cmds = pending.popleft()
+                    outputs = self.session.receive(len(cmds), timeout=timeout)
+                    for cmd, output in zip(cmds, outputs):
+                        self._check_output(cmd, output)
+                    yield "".join(outputs)
             finally:
-                self.lock.release()
+                if pending:
+                    logger.info("Abandoning %d queued gphoto batches", len(pending))
+                    self.session.kill()
+
+    def _ensure_session(self):
+        if not self.session.is_alive():
+            # first use or the previous shell crashed
+            start = time.monotonic()
+            self.invalidate_cache()
+            self.session.start()
+            elapsed = time.monotonic() - start
+            metrics.histogram("gphoto.session_start").observe(elapsed)
+            return elapsed
+        return None
+
+    def _check_output(self, cmd, output):
+        if GphotoSession.ERROR in output:
+            raise GphotoException(f"gphoto command failed ({cmd}): {output.strip()}")
+
+    def invalidate_cache(self, config=None):
+        if config is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(config, None)
+
+    def get_cached_config(self, config, max_age=None):
+        if max_age is None:
+            max_age = settings.GPHOTO_CONFIG_CACHE_TTL
+        try:
+            value, timestamp = self.cache[config]
+        except KeyError:
+            return None
+        if time.monotonic() - timestamp > max_age:
+            return None
+        return value
+
+    def get_camera_config(self, config, max_age=None, priority=SETTING):
+        return self.get_camera_configs([config], max_age=max_age, priority=priority)[
+            config
+        ]
+
+    def get_camera_configs(self, configs, max_age=None, priority=SETTING):
+        result = {}
+        missing = []
+        for config in configs:
+            value = self.get_cached_config(config, max_age=max_age)
+            if value is None:
+                missing.append(config)
+            else:
+                result[config] = value
+
+        if not missing:
             return result
-        except Exception as e:
-            raise GphotoException(f"Cannon exec gphoto command ({full_cmd})")
 
-    def get_camera_config(self, config):
+        # an identical read already waiting in the queue is shared
+        key = (tuple(missing), priority)
+        with self.reads_lock:
+            future = self.pending_reads.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending_reads[key] = concurrent.futures.Future()
+
+        if owner:
+            try:
+                future.set_result(self._read_configs(missing, priority))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.reads_lock:
+                    del self.pending_reads[key]
+
+        result.update(future.result())
+        return result
+
+    def _read_configs(self, configs, priority):
         try:
-            return self._get_current_config(self.exec_gphoto(f"--get-config {config}"))
+            outputs = self.exec_gphoto_batch(
+                [f"get-config {c}" for c in configs], priority=priority
+            )
         except GphotoException as e:
-            raise GphotoException(f"Cannot read current setting for {config}")
+            raise GphotoException(f"Cannot read current settings for {configs}: {e}")
+
+        result = {}
+        now = time.monotonic()
+        for config, output in zip(configs, outputs):
+            try:
+                value, choices = self._parse_config(output)
+            except GphotoException:
+                raise GphotoException(
+                    f"Cannot read current setting for {config}: {output.strip()}"
+                )
+            self.cache[config] = (value, now)
+            if choices:
+                self.choices[config] = choices
+            result[config] = value
+        return result
 
-    def set_camera_config(self, config, value=None, index=None):
+    def set_camera_config(self, config, value=None, index=None, priority=SETTING):
         if value is not None:
-            self.exec_gphoto(f"--set-config {config}={value}")
+            self.exec_gphoto(f"set-config {config}={value}", priority=priority)
+            self.cache[config] = (str(value), time.monotonic())
         elif index is not None:
-            self.exec_gphoto(f"--set-config-index {config}={index}")
+            self.exec_gphoto(f"set-config-index {config}={index}", priority=priority)
+            label = self.choices.get(config, {}).get(int(index))
+            if label is None:
+                self.invalidate_cache(config)
+            else:
+                self.cache[config] = (label, time.monotonic())
 
-    def _get_current_config(self, cmd_output):
-        search = "Current: "
-        for line in cmd_output.splitlines():
-            if line.startswith(search):
-                return line[len(search) :]
-        raise GphotoException("Cannot read current setting: no data in gphoto output")
+    def get_config_choices(self, config, priority=SETTING):
+        """
+        Returns the labels a config can be set to, in index order.
 
-    def get_time_as_string(self, time, options, bulb="bulb"):
-        for opt in options:
-            opt_float = self._float_from_string(opt)
+        Choices are stored on disk per camera model, so they are read from
+        the camera only once.
+        """
+        if config not in self.choices:
+            self.choices.update(self._load_choices())
+        if config not in self.choices:
+            self.get_camera_config(config, max_age=0, priority=priority)
+            self._store_choices()
+        return [label for _, label in sorted(self.choices.get(config, {}).items())]
 
-            if abs(opt_float - time) < 0.00001 or time < opt_float:
-                return opt
+    def _choices_path(self):
+        file_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.model) + ".json"
+        return os.path.join(settings.GPHOTO_CACHE_DIR, file_name)
 
-        return bulb
+    def _load_choices(self):
+        try:
+            with open(self._choices_path()) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {
+            config: {int(index): label for index, label in choices.items()}
+            for config, choices in stored.items()
+        }
+
+    def _store_choices(self):
+        path = self._choices_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.choices, f, indent=2)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning("Cannot store gphoto config choices in %s: %s", path, e)
 
-    def _float_from_string(self, string):
-        if "/" in string:
-            numerator, denominator = string.split("/")
-            return float(numerator) / float(denominator)
-        return float(string)
+    def _parse_config(self, cmd_output):
+        current = None
+        choices = {}
+        for line in cmd_output.splitlines():
+            if line.startswith("Current: "):
+                current = line[len("Current: ") :]
+            elif line.startswith("Choice: "):
+                index, _, label = line[len("Choice: ") :].partition(" ")
+                choices[int(index)] = label
+        if current is None:
+            raise GphotoException(
+                "Cannot read current setting: no data in gphoto output"
+            )
+        return current, choices
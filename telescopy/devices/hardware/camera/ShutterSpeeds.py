@@ -0,0 +1,52 @@
+import bisect
+import threading
+
+
+class ShutterSpeeds:
+    """
+    Exposure time index of a camera model.
+
+    Options are parsed and sorted once, lookups are a bisection returning
+    the option equal to the requested time or the next longer one, and
+    the bulb option for times longer than any of them.
+    """
+
+    TOLERANCE = 0.00001
+
+    _lock = threading.Lock()
+    _models = {}
+
+    def __init__(self, options, bulb="bulb"):
+        self.bulb = bulb
+        speeds = {}
+        for opt in options:
+            if opt.lower() == bulb.lower():
+                self.bulb = opt
+                continue
+            try:
+                value = self._float_from_string(opt)
+            except (ValueError, ZeroDivisionError):
+                # not an exposure time, e.g. a mode name
+                continue
+            speeds.setdefault(value, opt)
+        self.values = sorted(speeds)
+        self.labels = [speeds[value] for value in self.values]
+
+    @classmethod
+    def for_model(cls, model, load_options, bulb="bulb"):
+        with cls._lock:
+            if model not in cls._models:
+                cls._models[model] = cls(load_options(), bulb=bulb)
+            return cls._models[model]
+
+    def get_time_as_string(self, time):
+        i = bisect.bisect_left(self.values, time - self.TOLERANCE)
+        if i == len(self.values):
+            return self.bulb
+        return self.labels[i]
+
+    def _float_from_string(self, string):
+        if "/" in string:
+            numerator, denominator = string.split("/")
+            return float(numerator) / float(denominator)
+        return float(string)
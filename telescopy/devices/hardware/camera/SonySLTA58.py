@@ -1,7 +1,12 @@
+import collections
 import os
+import shutil
 import tempfile
 
-from .Gphoto import Gphoto
+from telescopy import metrics, settings
+
+from .Gphoto import Gphoto, GphotoException
+from .ShutterSpeeds import ShutterSpeeds
 
 
 class SonySLTA58:
@@ -17,6 +22,7 @@ class SonySLTA58:
         "3200": 7,
     }
 
+    # None to discover shutter speeds from the camera
     eposure_times = [
         "1/4000",
         "1/3200",
@@ -31,7 +37,6 @@ class SonySLTA58:
         "1/320",
         "1/250",
         "1/200",
-        "1/200",
         "1/160",
         "1/125",
         "1/100",
@@ -78,44 +83,144 @@ class SonySLTA58:
     def __init__(self):
         self.gphoto = Gphoto(self.model_name)
 
-    def expose(self, time):
-        time_as_string = self.gphoto.get_time_as_string(
-            time, self.eposure_times, bulb=self.bulb
+    def connect(self):
+        self.gphoto.open()
+
+    def disconnect(self):
+        self.gphoto.close()
+
+    def abort(self):
+        self.gphoto.abort()
+
+    def expose(self, time, staging_dir=None, timer=None):
+        """
+        Captures a frame and returns paths of the downloaded files by extension.
+
+        Files are downloaded by gphoto straight into a fresh directory
+        under `staging_dir`, the caller moves them away and then calls
+        `discard` to remove whatever is left. Durations of the exposure
+        phases are collected in `timer`.
+        """
+        timer = timer or metrics.PhaseTimer()
+        with self.gphoto.exposure():
+            time_as_string = self._get_time_as_string(time)
+
+            with timer.phase("set_speed"):
+                self._set_speed(time_as_string)
+
+            if staging_dir is not None and not os.path.exists(staging_dir):
+                os.makedirs(staging_dir)
+
+            tempdir = tempfile.mkdtemp(dir=staging_dir)
+
+            capture, download = self._capture_cmds(time, time_as_string)
+            timeout = time + settings.GPHOTO_TIMEOUT
+
+            try:
+                with self.gphoto.reserve(self.gphoto.CAPTURE, timer=timer) as run:
+                    run(f"lcd {tempdir}")
+                    with timer.phase("capture"):
+                        for cmd in capture:
+                            run(cmd, timeout=timeout)
+                    with timer.phase("download"):
+                        for cmd in download:
+                            run(cmd, timeout=timeout)
+            except Exception:
+                shutil.rmtree(tempdir, ignore_errors=True)
+                raise
+
+            return self._collect_files(tempdir)
+
+    def expose_sequence(self, time, count, staging_dir=None, delay=0, stop=None):
+        """
+        Captures `count` frames, yielding paths of every frame's files as
+        `expose` returns them.
+
+        The next frame is already queued in gphoto while the current one
+        is handed over, so the caller's handling of frame N overlaps
+        with integration of frame N+1. No frame is queued once the `stop`
+        event is set, and closing the generator early abandons the frame
+        being integrated.
+        """
+        with self.gphoto.exposure():
+            time_as_string = self._get_time_as_string(time)
+
+            self._set_speed(time_as_string)
+
+            if staging_dir is not None and not os.path.exists(staging_dir):
+                os.makedirs(staging_dir)
+
+            tempdirs = collections.deque()
+
+            def batches():
+                for _ in range(count):
+                    if stop is not None and stop.is_set():
+                        return
+                    tempdir = tempfile.mkdtemp(dir=staging_dir)
+                    tempdirs.append(tempdir)
+                    cmds = [f"lcd {tempdir}"]
+                    if delay:
+                        cmds += [f"wait-event {delay}s"]
+                    capture, download = self._capture_cmds(time, time_as_string)
+                    yield cmds + capture + download
+
+            frames = self.gphoto.exec_gphoto_pipelined(
+                batches(), timeout=time + delay + settings.GPHOTO_TIMEOUT
+            )
+            try:
+                for _ in frames:
+                    yield self._collect_files(tempdirs.popleft())
+            finally:
+                frames.close()
+                for tempdir in tempdirs:
+                    shutil.rmtree(tempdir, ignore_errors=True)
+
+    def _get_time_as_string(self, time):
+        speeds = ShutterSpeeds.for_model(
+            self.model_name,
+            lambda: self.eposure_times
+            or self.gphoto.get_config_choices(
+                "shutterspeed", priority=self.gphoto.CAPTURE
+            ),
+            bulb=self.bulb,
         )
+        return speeds.get_time_as_string(time)
 
-        self._set_speed(time_as_string)
-
-        tempdir = tempfile.mkdtemp()
-
-        target_file = os.path.join(tempdir, "img")
-
-        cmd = f"--force-overwrite --filename={target_file}.%C"
-
+    def _capture_cmds(self, time, time_as_string):
+        """
+        Returns gphoto commands taking the exposure and commands downloading
+        the files. Timed exposures are downloaded by the capture command.
+        """
         if time_as_string == self.bulb:
-            cmd += (
-                " --set-config capture=on"
-                f" --wait-event={time}s"
-                " --set-config capture=off"
-                " --wait-event-and-download=10s"
+            return (
+                [
+                    "set-config capture=on",
+                    f"wait-event {time}s",
+                    "set-config capture=off",
+                ],
+                ["wait-event-and-download 10s"],
             )
-        else:
-            cmd += " --capture-image-and-download"
-
-        self.gphoto.exec_gphoto(cmd)
+        return ["capture-image-and-download"], []
 
+    def _collect_files(self, tempdir):
         result = {}
 
-        for ext in self.extensions:
-            file = f"{target_file}.{ext}"
-            if os.path.exists(file):
-                with open(file, mode="rb") as f:
-                    result[ext] = f.read()
-                os.unlink(file)
+        for file_name in os.listdir(tempdir):
+            ext = os.path.splitext(file_name)[1][1:].lower()
+            if ext in self.extensions:
+                result[ext] = os.path.join(tempdir, file_name)
 
-        os.rmdir(tempdir)
+        if not result:
+            # discard() finds the directory through the files collected
+            shutil.rmtree(tempdir, ignore_errors=True)
+            raise GphotoException("Camera returned no image files")
 
         return result
 
+    def discard(self, files):
+        for file in files.values():
+            shutil.rmtree(os.path.dirname(file), ignore_errors=True)
+
     def get_iso(self):
         return self.gphoto.get_camera_config("iso")
 
@@ -136,13 +241,14 @@ class SonySLTA58:
         self.gphoto.set_camera_config("imagequality", index=format_idx)
 
     def get_format(self):
+        return self._parse_format(self.gphoto.get_camera_config("imagequality"))
+
+    def _parse_format(self, format_val):
         res = {
             "jpeg": False,
             "raw": False,
         }
 
-        format_val = self.gphoto.get_camera_config("imagequality")
-
         if format_val == "RAW+JPEG":
             res["jpeg"] = True
             res["raw"] = True
@@ -155,8 +261,44 @@ class SonySLTA58:
 
         return res
 
+    def get_info(self):
+        configs = self.gphoto.get_camera_configs(
+            [
+                "iso",
+                "imagequality",
+                "manufacturer",
+                "cameramodel",
+                "deviceversion",
+                "serialnumber",
+            ]
+        )
+        return {
+            "iso": configs["iso"],
+            "format": self._parse_format(configs["imagequality"]),
+            "manufacturer": configs["manufacturer"],
+            "camera_model": configs["cameramodel"],
+            "device_version": configs["deviceversion"],
+            "serial_number": configs["serialnumber"],
+        }
+
+    def get_status(self):
+        # shutterspeed is only read to keep the cached value honest
+        # when the dial is turned on the camera body
+        configs = self.gphoto.get_camera_configs(
+            ["batterylevel", "iso", "imagequality", "shutterspeed"],
+            max_age=0,
+            priority=self.gphoto.HOUSEKEEPING,
+        )
+        return {
+            "battery_level": configs["batterylevel"],
+            "iso": configs["iso"],
+            "format": self._parse_format(configs["imagequality"]),
+        }
+
     def get_battery_level(self):
-        return self.gphoto.get_camera_config("batterylevel")
+        return self.gphoto.get_camera_config(
+            "batterylevel", max_age=0, priority=self.gphoto.HOUSEKEEPING
+        )
 
     def get_serial_number(self):
         return self.gphoto.get_camera_config("serialnumber")
@@ -171,4 +313,8 @@ class SonySLTA58:
         return self.gphoto.get_camera_config("cameramodel")
 
     def _set_speed(self, speed):
-        self.gphoto.set_camera_config("shutterspeed", speed)
+        if self.gphoto.get_cached_config("shutterspeed") == speed:
+            return
+        self.gphoto.set_camera_config(
+            "shutterspeed", speed, priority=self.gphoto.CAPTURE
+        )
@@ -0,0 +1,50 @@
+import collections
+import threading
+
+from . import settings
+
+
+class FrameFeed:
+    """
+    Records of newly saved frames for push notifications.
+
+    Every record gets an increasing id, the last FEED_HISTORY of them are
+    kept so clients can resume from the id they have seen last.
+    """
+
+    condition = threading.Condition()
+    records = collections.deque(maxlen=settings.FEED_HISTORY)
+    last_id = 0
+
+    @classmethod
+    def publish(cls, entry, exposure=None):
+        """
+        Publishes a Catalog entry of a frame taken with `exposure` seconds.
+        """
+        with cls.condition:
+            cls.last_id += 1
+            record = {
+                "id": cls.last_id,
+                "device": entry["device"],
+                "url": entry["url"],
+                "ext": entry["ext"],
+                "size": entry["size"],
+                "exposure": exposure,
+                "timestamp": entry["mtime"],
+            }
+            cls.records.append(record)
+            cls.condition.notify_all()
+        return record
+
+    @classmethod
+    def wait(cls, cursor, timeout=None):
+        """
+        Returns records published after id `cursor`, waiting up to `timeout`
+        seconds for any. Records older than FEED_HISTORY are missing.
+        """
+        with cls.condition:
+            if cursor > cls.last_id:
+                # a cursor from before a restart
+                cursor = 0
+            cls.condition.wait_for(lambda: cls.last_id > cursor, timeout)
+            return [r for r in cls.records if r["id"] > cursor]
@@ -1,65 +1,726 @@
+import datetime
+import email.utils
 import http.server
+import json
 import os
 import posixpath
+import re
+import shutil
 import socketserver
+import tarfile
 import threading
+import time
 import urllib.parse
+import zipfile
 from http import HTTPStatus
 
-from . import settings
+from . import metrics, settings
+from .catalog import Catalog
+from .feed import FrameFeed
+from .previews import PreviewCache
+from .profiling import ProfilerBusy, SamplingProfiler, Timing
+
+
+class ChunkedWriter:
+    """
+    Write-only file object sending HTTP/1.1 chunked transfer encoding,
+    for responses streamed before their length is known. Small writes
+    are buffered into chunks of at least `buffer_size` bytes.
+    """
+
+    def __init__(self, wfile, buffer_size):
+        self.wfile = wfile
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(b"%X\r\n" % len(self.buffer))
+            self.wfile.write(self.buffer)
+            self.wfile.write(b"\r\n")
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class HttpHandler(http.server.SimpleHTTPRequestHandler):
+    API_PREFIX = "/api/"
+
+    # keep-alive, idle connections are closed after `timeout` seconds
+    protocol_version = "HTTP/1.1"
+    timeout = settings.HTTP_TIMEOUT
+
+    # frames and their derivatives are named after their capture time
+    # and never change once written
+    IMMUTABLE_NAME = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6}\.")
+    IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+    # PreviewCache, set up by HttpServer.start
+    previews = None
+
+    # archives are streamed in chunks of this size
+    ARCHIVE_BUFFER_SIZE = 256 * 1024
+    ARCHIVE_CONTENT_TYPES = {"tar": "application/x-tar", "zip": "application/zip"}
+    ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+    MAX_REQUEST_BODY = 1024 * 1024
+
+    # (offset, count) of the file body sent by copyfile, set up by
+    # send_head for the current request only, None for other bodies
+    body_range = None
+    # file that body is sent from
+    body_path = None
+
+    def translate_path(self, path):
+        # abandon query parameters
+        path = path.split("?", 1)[0]
+        path = path.split("#", 1)[0]
+        # Don't forget explicit trailing slash when normalizing. Issue17324
+        trailing_slash = path.rstrip().endswith("/")
+        try:
+            path = urllib.parse.unquote(path, errors="surrogatepass")
+        except UnicodeDecodeError:
+            path = urllib.parse.unquote(path)
+        path = posixpath.normpath(path)
+        words = path.split("/")
+        words = filter(None, words)
+
+        path = settings.PUB_DIR
+
+        for word in words:
+            if os.path.dirname(word) or word in (os.curdir, os.pardir):
+                # Ignore components that are not a simple file/directory name
+                continue
+            if word.startswith("."):
+                # Hidden entries (e.g. the staging dir) are not published
+                continue
+            path = os.path.join(path, word)
+        if trailing_slash:
+            path += "/"
+        return path
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if self.path.startswith(self.API_PREFIX):
+            self.handle_api()
+        elif "preview" in query:
+            self.send_preview(query["preview"][-1])
+        else:
+            super().do_GET()
+
+    def send_preview(self, size):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+        try:
+            size = int(size)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid preview size")
+            return
+        size = max(settings.PREVIEW_MIN_SIZE, min(size, settings.PREVIEW_MAX_SIZE))
+
+        fs = os.stat(path)
+        etag = f'{self.etag(fs)[:-1]}-p{size}"'
+        if self.not_modified(fs, etag=etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_cache_headers(path, fs, etag=etag)
+            self.end_headers()
+            return
+
+        try:
+            data = self.previews.get(path, size)
+        except Exception as e:
+            self.log_error("Cannot render preview of %s: %s", path, e)
+            self.send_error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "No preview available")
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_cache_headers(path, fs, etag=etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        try:
+            super().do_HEAD()
+        finally:
+            # no body is sent, state set up for it must not reach
+            # the next request on the connection
+            self.body_range = None
+            self.body_path = None
+
+    def send_head(self):
+        self.body_range = None
+        self.body_path = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urllib.parse.urlsplit(self.path)
+            if not parts.path.endswith("/"):
+                # Python 3.6 redirects without Content-Length, keep-alive
+                # clients would wait for a body until HTTP_TIMEOUT
+                location = parts._replace(path=parts.path + "/")
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header("Location", urllib.parse.urlunsplit(location))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            return super().send_head()
+        if path.endswith("/"):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+            size = fs.st_size
+
+            if self.not_modified(fs):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_cache_headers(path, fs)
+                self.end_headers()
+                f.close()
+                return None
+
+            byte_range = self.requested_range(size, fs)
+
+            if byte_range is None:
+                self.body_range = (0, size)
+                self.send_response(HTTPStatus.OK)
+            elif byte_range is False:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                f.close()
+                return None
+            else:
+                start, end = byte_range
+                self.body_range = (start, end - start + 1)
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+            self.body_path = path
+            self.send_header("Content-type", self.guess_type(path))
+            self.send_header("Content-Length", str(self.body_range[1]))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_cache_headers(path, fs)
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
+
+    def etag(self, fs):
+        return f'"{fs.st_ino:x}-{fs.st_size:x}-{fs.st_mtime_ns:x}"'
+
+    def weak(self, etag):
+        return etag[2:] if etag.startswith("W/") else etag
+
+    def not_modified(self, fs, etag=None):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # weak comparison, proxies may have weakened the tags
+            tags = [self.weak(tag.strip()) for tag in if_none_match.split(",")]
+            return "*" in tags or self.weak(etag or self.etag(fs)) in tags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            return int(fs.st_mtime) <= since.timestamp()
+
+        return False
+
+    def send_cache_headers(self, path, fs, etag=None):
+        self.send_header("ETag", etag or self.etag(fs))
+        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+        if self.IMMUTABLE_NAME.match(os.path.basename(path)):
+            self.send_header("Cache-Control", self.IMMUTABLE_CACHE_CONTROL)
+        else:
+            self.send_header("Cache-Control", "no-cache")
+
+    def requested_range(self, size, fs):
+        """
+        Returns (first, last) byte of a satisfiable single range request,
+        False for an unsatisfiable one and None to send the whole file.
+        Multiple ranges are answered with the whole file.
+        """
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range not in (
+            self.etag(fs),
+            self.date_time_string(fs.st_mtime),
+        ):
+            return None
+
+        first, _, last = header[len("bytes=") :].strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+            else:
+                # suffix range, the last N bytes
+                start = max(0, size - int(last))
+                end = size - 1
+        except ValueError:
+            return None
+
+        if start > end and last:
+            return None
+        if start >= size:
+            return False
+        return start, min(end, size - 1)
+
+    def copyfile(self, source, outputfile):
+        body_range, self.body_range = self.body_range, None
+        path, self.body_path = self.body_path, None
+        if body_range is None:
+            # directory listings
+            super().copyfile(source, outputfile)
+            return
+
+        offset, count = body_range
+        sent = 0
+        if count:
+            # sendfile(2) moves file pages to the socket in the kernel,
+            # the socket module falls back to send() where it is unavailable
+            sent = self.connection.sendfile(source, offset=offset, count=count)
+        # a frame is downloaded once all its bytes were sent, in one
+        # response or in ranges (resumed or parallel downloads)
+        Catalog.mark_sent(path, offset, offset + sent)
+
+    def do_POST(self):
+        if self.path.startswith(self.API_PREFIX):
+            self.handle_api()
+        else:
+            self.send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
+
+    def do_DELETE(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            try:
+                Catalog.delete(path)
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            except:
+                self.send_error(
+                    HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+                )
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+
+    def handle_api(self):
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path[len(self.API_PREFIX) :].strip("/").replace("/", "_")
+        handler = getattr(self, f"api_{self.command.lower()}_{endpoint}", None)
+        if handler is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Unknown API endpoint")
+            return
+        query = urllib.parse.parse_qs(url.query)
+        handler({k: v[-1] for k, v in query.items()})
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if not 0 < length <= self.MAX_REQUEST_BODY:
+            raise ValueError("Invalid request body length")
+        return json.loads(self.rfile.read(length).decode())
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def api_get_metrics(self, query):
+        self.send_json(metrics.snapshot())
+
+    def catalog_filters(self, query):
+        """
+        Catalog.query filters from API parameters, ValueError when invalid.
+        """
+        filters = {}
+        for key in ("device", "prefix", "ext"):
+            if query.get(key):
+                filters[key] = str(query[key])
+        if "ext" in filters:
+            filters["ext"] = filters["ext"].lower()
+        for key in ("since", "until"):
+            if query.get(key) not in (None, ""):
+                try:
+                    filters[key] = float(query[key])
+                except TypeError:
+                    raise ValueError(f"Invalid {key}")
+        return filters
+
+    def api_get_profile(self, query):
+        """
+        Samples stacks of all threads for `seconds`, or until stopped, and
+        returns them folded for flame graph tools.
+        """
+        try:
+            seconds = float(query.get("seconds", 10))
+            interval = float(query.get("interval", settings.PROFILE_INTERVAL))
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid query parameter")
+            return
+        seconds = max(0, min(seconds, settings.PROFILE_MAX_SECONDS))
+        interval = max(0.001, interval)
+
+        try:
+            profiler = SamplingProfiler.profile(seconds, interval)
+        except ProfilerBusy as e:
+            self.send_error(HTTPStatus.CONFLICT, str(e))
+            return
+
+        body = profiler.folded().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Profile-Samples", str(profiler.samples))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def api_post_profile_stop(self, query):
+        self.send_json({"stopped": SamplingProfiler.stop()})
+
+    def api_get_timing(self, query):
+        self.send_json({"enabled": Timing.enabled})
+
+    def api_post_timing(self, query):
+        Timing.enabled = query.get("enabled", "").lower() in ("1", "true", "yes", "on")
+        self.send_json({"enabled": Timing.enabled})
+
+    def api_get_catalog(self, query):
+        try:
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", settings.CATALOG_PAGE_SIZE))
+            filters = self.catalog_filters(query)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid query parameter")
+            return
+
+        offset = max(0, offset)
+        limit = max(0, min(limit, settings.CATALOG_MAX_PAGE_SIZE))
+        total, entries = Catalog.query(offset=offset, limit=limit, **filters)
+        self.send_json(
+            {"total": total, "offset": offset, "limit": limit, "items": entries}
+        )
+
+    def api_post_delete(self, query):
+        """
+        Deletes frames listed in a JSON body, as {"paths": [...]} of URLs or
+        paths relative to PUB_DIR, or selected by the catalog filters
+        (device, prefix, ext, since, until), at least one of them required.
+        """
+        try:
+            request = self.read_json()
+            if not isinstance(request, dict):
+                raise ValueError("Expected an object")
+            if "paths" in request:
+                paths = [
+                    self.translate_path(urllib.parse.urlsplit(path).path)
+                    for path in request["paths"]
+                ]
+            else:
+                filters = self.catalog_filters(request)
+                if not filters:
+                    raise ValueError("No frames selected")
+                _, entries = Catalog.query(**filters)
+                paths = [
+                    os.path.join(settings.PUB_DIR, entry["path"]) for entry in entries
+                ]
+        except (ValueError, TypeError, AttributeError):
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid request")
+            return
+
+        deleted = []
+        missing = []
+        for path in paths:
+            rel_path = os.path.relpath(path, settings.PUB_DIR).replace(os.sep, "/")
+            if os.path.isfile(path) and Catalog.delete(path):
+                deleted.append(rel_path)
+            else:
+                missing.append(rel_path)
+        self.send_json({"deleted": deleted, "missing": missing})
+
+    def api_get_archive(self, query):
+        """
+        Streams frames selected by the catalog filters as a tar (default)
+        or zip archive, built while it is sent.
+        """
+        archive_format = query.get("format", "tar")
+        try:
+            if archive_format not in self.ARCHIVE_CONTENT_TYPES:
+                raise ValueError("Unknown archive format")
+            filters = self.catalog_filters(query)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid query parameter")
+            return
+
+        _, entries = Catalog.query(**filters)
+        file_name = (
+            f"{filters.get('device', 'telescopy')}-"
+            f"{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}.{archive_format}"
+        )
+
+        # HTTP/1.0 clients get the archive until the connection is closed
+        chunked = self.request_version != "HTTP/1.0"
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", self.ARCHIVE_CONTENT_TYPES[archive_format])
+        self.send_header("Content-Disposition", f'attachment; filename="{file_name}"')
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+
+        if chunked:
+            out = ChunkedWriter(self.wfile, self.ARCHIVE_BUFFER_SIZE)
+        else:
+            out = self.wfile
+        # (path, bytes) of files added to the archive
+        sent = []
+        try:
+            if archive_format == "zip":
+                self.write_zip(out, entries, sent)
+            else:
+                self.write_tar(out, entries, sent)
+            if chunked:
+                out.close()
+            for path, size in sent:
+                Catalog.mark_sent(path, 0, size)
+        except Exception as e:
+            # the response is cut short, the client sees an incomplete body
+            self.log_error("Archive download aborted: %s", e)
+            self.close_connection = True
+
+    def api_get_events(self, query):
+        """
+        Server-sent events feed of new frames. Clients resume after the
+        record id given as `cursor` or in the Last-Event-ID header, a
+        `gap` event tells records were lost and the catalog has to be
+        queried for them.
+        """
+        try:
+            last_event_id = self.headers.get("Last-Event-ID", -1)
+            cursor = int(query.get("cursor", last_event_id))
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid cursor")
+            return
+
+        if not self.server.subscribe(self.request):
+            self.send_error(
+                HTTPStatus.SERVICE_UNAVAILABLE, "Too many event feed subscribers"
+            )
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # every event is sent in a chunk of its own right away
+        out = ChunkedWriter(self.wfile, 0)
+        self.close_connection = True
+
+        if cursor < 0:
+            cursor = FrameFeed.last_id
+        try:
+            while True:
+                records = FrameFeed.wait(cursor, settings.FEED_HEARTBEAT)
+                if cursor and records and records[0]["id"] > cursor + 1:
+                    gap = {"after": cursor, "before": records[0]["id"]}
+                    out.write(f"event: gap\ndata: {json.dumps(gap)}\n\n".encode())
+                if not records:
+                    out.write(b": keep-alive\n\n")
+                for record in records:
+                    out.write(
+                        f"id: {record['id']}\nevent: frame\n"
+                        f"data: {json.dumps(record)}\n\n".encode()
+                    )
+                    cursor = record["id"]
+        except OSError:
+            # client is gone
+            pass
+
+    def archive_files(self, entries, sent):
+        # frames deleted since the query are skipped
+        for entry in entries:
+            path = os.path.join(settings.PUB_DIR, entry["path"])
+            try:
+                f = open(path, "rb")
+            except OSError:
+                continue
+            with f:
+                yield entry["path"], f
+                sent.append((path, f.tell()))
+
+    def write_tar(self, out, entries, sent):
+        with tarfile.open(
+            fileobj=out, mode="w|", bufsize=self.ARCHIVE_BUFFER_SIZE
+        ) as tar:
+            for name, f in self.archive_files(entries, sent):
+                tar.addfile(tar.gettarinfo(arcname=name, fileobj=f), f)
+
+    def write_zip(self, out, entries, sent):
+        # frames are compressed already, they are stored as they are
+        with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_STORED) as zf:
+            for name, f in self.archive_files(entries, sent):
+                mtime = time.localtime(os.fstat(f.fileno()).st_mtime)
+                info = zipfile.ZipInfo(name, max(mtime[:6], self.ZIP_EPOCH))
+                with zf.open(info, mode="w") as target:
+                    shutil.copyfileobj(f, target, self.ARCHIVE_BUFFER_SIZE)
+
+
+class PooledHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serves every connection on its own thread, at most `max_connections`
+    at a time. When all are busy a new connection waits up to
+    `queue_timeout` seconds for one, holding up the ones behind it in the
+    listen backlog, and is then answered with 503.
+
+    Event feed connections stay open for as long as their clients listen,
+    they move to `max_subscribers` slots of their own so they never take
+    all the shared ones.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    BUSY_RESPONSE = (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Content-Length: 0\r\n"
+        b"Retry-After: 1\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        max_connections,
+        queue_timeout,
+        max_subscribers,
+    ):
+        super().__init__(server_address, handler_class)
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.queue_timeout = queue_timeout
+        self.stopping = False
+        self.subscriber_slots = threading.BoundedSemaphore(max_subscribers)
+        self.subscribers = set()
+        self.subscribers_lock = threading.Lock()
+
+    def shutdown(self):
+        self.stopping = True
+        super().shutdown()
+
+    def process_request(self, request, client_address):
+        # runs in the serve_forever() thread, which has to get back to
+        # polling for shutdown() to return
+        deadline = time.monotonic() + self.queue_timeout
+        while not self.slots.acquire(timeout=0.5):
+            if self.stopping or time.monotonic() >= deadline:
+                self.reject(request)
+                return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def subscribe(self, request):
+        """
+        Moves the connection of `request` from a shared slot to a slot of
+        subscribers, False when those are all taken.
+        """
+        if not self.subscriber_slots.acquire(blocking=False):
+            return False
+        with self.subscribers_lock:
+            self.subscribers.add(request)
+        self.slots.release()
+        return True
+
+    def reject(self, request):
+        try:
+            request.settimeout(1)
+            request.sendall(self.BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.subscribers_lock:
+                subscribed = request in self.subscribers
+                self.subscribers.discard(request)
+            if subscribed:
+                self.subscriber_slots.release()
+            else:
+                self.slots.release()
 
 
 class HttpServer:
+    httpd = None
+
     @classmethod
     def http_server(cls):
-        class HttpHandler(http.server.SimpleHTTPRequestHandler):
-            def translate_path(self, path):
-                # abandon query parameters
-                path = path.split("?", 1)[0]
-                path = path.split("#", 1)[0]
-                # Don't forget explicit trailing slash when normalizing. Issue17324
-                trailing_slash = path.rstrip().endswith("/")
-                try:
-                    path = urllib.parse.unquote(path, errors="surrogatepass")
-                except UnicodeDecodeError:
-                    path = urllib.parse.unquote(path)
-                path = posixpath.normpath(path)
-                words = path.split("/")
-                words = filter(None, words)
-
-                path = settings.PUB_DIR
-
-                for word in words:
-                    if os.path.dirname(word) or word in (os.curdir, os.pardir):
-                        # Ignore components that are not a simple file/directory name
-                        continue
-                    path = os.path.join(path, word)
-                if trailing_slash:
-                    path += "/"
-                return path
-
-            def do_DELETE(self):
-                path = self.translate_path(self.path)
-                if os.path.isfile(path):
-                    try:
-                        os.unlink(path)
-                        self.send_response(HTTPStatus.OK)
-                        self.end_headers()
-                    except:
-                        self.send_error(
-                            HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
-                        )
-                else:
-                    self.send_error(HTTPStatus.NOT_FOUND, "File not found")
-
-        socketserver.TCPServer.allow_reuse_address = True
-        with socketserver.TCPServer(("", settings.HTTP_PORT), HttpHandler) as httpd:
-            httpd.serve_forever()
+        with PooledHTTPServer(
+            ("", settings.HTTP_PORT),
+            HttpHandler,
+            settings.HTTP_MAX_CONNECTIONS,
+            settings.HTTP_QUEUE_TIMEOUT,
+            settings.FEED_MAX_SUBSCRIBERS,
+        ) as httpd:
+            cls.httpd = httpd
+            try:
+                httpd.serve_forever()
+            finally:
+                cls.httpd = None
 
     @classmethod
-    def start(cls):
+    def setup(cls):
         if not os.path.exists(settings.PUB_DIR):
             os.makedirs(settings.PUB_DIR)
+        # frames left half-downloaded by a crash, nothing is being taken yet
+        shutil.rmtree(settings.STAGING_DIR, ignore_errors=True)
 
+        Catalog.rebuild()
+        HttpHandler.previews = PreviewCache()
+
+    @classmethod
+    def stop(cls):
+        if cls.httpd is not None:
+            cls.httpd.shutdown()
+
+    @classmethod
+    def start(cls):
+        cls.setup()
         http_th = threading.Thread(target=cls.http_server, daemon=True)
         http_th.start()
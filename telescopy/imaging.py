@@ -0,0 +1,124 @@
+import io
+import struct
+
+from PIL import Image, ImageStat
+
+TIFF_SUBIFDS = 0x014A
+TIFF_JPEG_OFFSET = 0x0201
+TIFF_JPEG_LENGTH = 0x0202
+
+RAW_EXTENSIONS = ("arw",)
+
+
+def extract_embedded_jpeg(path):
+    """
+    Returns the largest JPEG preview embedded in a TIFF based raw file (ARW),
+    or None. Only the IFDs and the preview itself are read from disk.
+    """
+    with open(path, "rb") as f:
+        header = f.read(8)
+        if header[:2] == b"II":
+            endian = "<"
+        elif header[:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+
+        previews = []
+        visited = set()
+        pending = [struct.unpack(endian + "I", header[4:8])[0]]
+
+        while pending:
+            offset = pending.pop()
+            if not offset or offset in visited or len(visited) > 32:
+                continue
+            visited.add(offset)
+
+            f.seek(offset)
+            raw_count = f.read(2)
+            if len(raw_count) < 2:
+                continue
+            (count,) = struct.unpack(endian + "H", raw_count)
+            entries = f.read(count * 12 + 4)
+            if len(entries) < count * 12 + 4:
+                continue
+
+            tags = {}
+            for i in range(count):
+                tag, typ, num, value = struct.unpack(
+                    endian + "HHII", entries[i * 12 : i * 12 + 12]
+                )
+                tags[tag] = (typ, num, value)
+
+            if TIFF_JPEG_OFFSET in tags and TIFF_JPEG_LENGTH in tags:
+                previews.append(
+                    (tags[TIFF_JPEG_LENGTH][2], tags[TIFF_JPEG_OFFSET][2])
+                )
+
+            if TIFF_SUBIFDS in tags:
+                typ, num, value = tags[TIFF_SUBIFDS]
+                if num == 1:
+                    pending.append(value)
+                else:
+                    f.seek(value)
+                    pending += struct.unpack(endian + "I" * num, f.read(4 * num))
+
+            pending.append(struct.unpack(endian + "I", entries[-4:])[0])
+
+        if not previews:
+            return None
+
+        length, offset = max(previews)
+        f.seek(offset)
+        return f.read(length)
+
+
+def open_image(path, size=None):
+    """
+    Opens a frame for previewing. Raw files are represented by their
+    embedded JPEG, JPEGs are decoded at a reduced scale when `size` is given.
+    """
+    if path.lower().rsplit(".", 1)[-1] in RAW_EXTENSIONS:
+        data = extract_embedded_jpeg(path)
+        if data is None:
+            raise ValueError(f"No embedded preview in {path}")
+        image = Image.open(io.BytesIO(data))
+    else:
+        image = Image.open(path)
+
+    if size is not None:
+        image.draft("RGB", (size, size))
+    return image
+
+
+def render_preview(path, size, quality=85):
+    image = open_image(path, size).convert("RGB")
+    image.thumbnail((size, size))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def render_derivatives(
+    path, preview_path, preview_size, thumbnail_path, thumbnail_size
+):
+    """
+    Writes a preview and a thumbnail of a frame and returns its statistics.
+    Runs in a worker process.
+    """
+    image = open_image(path, preview_size).convert("RGB")
+    image.thumbnail((preview_size, preview_size))
+    image.save(preview_path, format="JPEG", quality=85)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+    thumbnail.save(thumbnail_path, format="JPEG", quality=80)
+
+    stat = ImageStat.Stat(image.convert("L"))
+    minimum, maximum = stat.extrema[0]
+    return {
+        "mean": stat.mean[0],
+        "stddev": stat.stddev[0],
+        "min": minimum,
+        "max": maximum,
+    }
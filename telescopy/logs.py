@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+import time
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records over to a listener thread passing them to the handlers
+    of the `sink` logger, so slow handlers (console, INDI clients) never
+    hold up the thread logging.
+
+    Records are neither formatted nor copied when queued, formatting
+    happens on the listener thread. Each logger may log `rate` records
+    a second, with bursts of up to `burst`, overridden per logger name
+    with {"rate": ..., "burst": ...} in `limits`. Records over the limit
+    are dropped except every `sample`-th one, as are records not fitting
+    in the queue. The number dropped is logged when records go through
+    again.
+    """
+
+    def __init__(
+        self,
+        sink,
+        queue_size=10000,
+        rate=10,
+        burst=50,
+        sample=100,
+        limits=None,
+        level=logging.NOTSET,
+    ):
+        super().__init__(level)
+        self.sink = logging.getLogger(sink)
+        self.queue = queue.Queue(queue_size)
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.limits = limits or {}
+        # logger name: [tokens, last refill, dropped since last passed]
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.overflow = 0
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def emit(self, record):
+        dropped = self.admit(record.name)
+        if dropped is None:
+            return
+        if dropped:
+            self.enqueue(
+                self.summary(record.name, "%d records dropped by rate limit", dropped)
+            )
+        self.enqueue(record)
+
+    def admit(self, name):
+        """
+        Returns None when a record of logger `name` is to be dropped,
+        otherwise the number of its records dropped before.
+        """
+        limit = self.limits.get(name, {})
+        rate = limit.get("rate", self.rate)
+        burst = limit.get("burst", self.burst)
+        now = time.monotonic()
+        with self.buckets_lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = self.buckets[name] = [burst, now, 0]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                dropped = bucket[2]
+            else:
+                bucket[2] += 1
+                if bucket[2] % self.sample:
+                    return None
+                # sampled
+                dropped = bucket[2] - 1
+            bucket[2] = 0
+            return dropped
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.overflow += 1
+
+    def summary(self, name, msg, dropped):
+        return logging.makeLogRecord(
+            {
+                "name": name,
+                "levelno": logging.WARNING,
+                "levelname": logging.getLevelName(logging.WARNING),
+                "msg": msg,
+                "args": (dropped,),
+            }
+        )
+
+    def listen(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            if self.overflow:
+                overflow, self.overflow = self.overflow, 0
+                self.sink.handle(
+                    self.summary(__name__, "%d records dropped, queue full", overflow)
+                )
+            try:
+                self.sink.handle(record)
+            except Exception:
+                self.handleError(record)
+
+    def close(self):
+        # flushes queued records
+        if self.listener.is_alive():
+            try:
+                self.queue.put(None, timeout=2)
+            except queue.Full:
+                pass
+            self.listener.join(timeout=2)
+        super().close()
@@ -0,0 +1,90 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+class Histogram:
+    BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, name, buckets=None):
+        self.name = name
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self):
+        with self.lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "buckets": buckets,
+            }
+
+
+_lock = threading.Lock()
+_histograms = {}
+
+
+def histogram(name, buckets=None):
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, buckets)
+        return _histograms[name]
+
+
+def snapshot():
+    with _lock:
+        histograms = list(_histograms.values())
+    return {h.name: h.snapshot() for h in histograms}
+
+
+class PhaseTimer:
+    """
+    Collects monotonic durations of named phases of one operation.
+
+    With a `prefix`, every phase is also observed in the
+    `<prefix>.<phase>` histogram. Repeated phases add up.
+    """
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.phases = collections.OrderedDict()
+        self.started = time.monotonic()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.prefix is not None:
+            histogram(f"{self.prefix}.{name}").observe(seconds)
+
+    def total(self):
+        return time.monotonic() - self.started
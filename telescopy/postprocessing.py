@@ -0,0 +1,116 @@
+import concurrent.futures
+import logging
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from . import settings
+from .imaging import render_derivatives
+
+logger = logging.getLogger(__name__)
+
+
+class PostProcessor:
+    """
+    Renders previews, thumbnails and statistics of saved frames in a
+    bounded process pool.
+
+    Submitting never blocks: when `queue_size` frames are already waiting
+    the new one is skipped, so post-processing can not slow down exposures.
+    """
+
+    PREVIEWS_DIR = "previews"
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or settings.POSTPROCESS_WORKERS
+        self.slots = threading.BoundedSemaphore(
+            queue_size or settings.POSTPROCESS_QUEUE_SIZE
+        )
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers
+                )
+            return self.pool
+
+    def _discard_pool(self, pool):
+        # a worker died (e.g. killed by the OOM killer), the pool accepts
+        # no more work and is replaced on next submit
+        with self.lock:
+            if self.pool is not pool:
+                return
+            self.pool = None
+        logger.warning("Post-processing pool is broken, starting a new one")
+        pool.shutdown(wait=False)
+
+    def submit(self, path, callback):
+        """
+        Schedules post-processing of the frame at `path`, which has to be
+        inside PUB_DIR. `callback` is called with a dict of derived artifact
+        URLs and frame statistics once they are ready.
+
+        Failures are logged and never raised, the frame is saved already.
+        """
+        if not self.slots.acquire(blocking=False):
+            logger.warning("Post-processing queue is full, skipping %s", path)
+            return False
+
+        directory, file_name = os.path.split(path)
+        base_name = os.path.splitext(file_name)[0]
+        target_dir = os.path.join(directory, self.PREVIEWS_DIR)
+        preview_path = os.path.join(target_dir, f"{base_name}.preview.jpg")
+        thumbnail_path = os.path.join(target_dir, f"{base_name}.thumb.jpg")
+
+        pool = None
+        try:
+            os.makedirs(target_dir, exist_ok=True)
+            pool = self._get_pool()
+            future = pool.submit(
+                render_derivatives,
+                path,
+                preview_path,
+                settings.PREVIEW_SIZE,
+                thumbnail_path,
+                settings.THUMBNAIL_SIZE,
+            )
+        except Exception as e:
+            self.slots.release()
+            logger.error("Cannot post-process %s: %s", path, e)
+            if isinstance(e, BrokenProcessPool):
+                self._discard_pool(pool)
+            return False
+
+        def done(future):
+            self.slots.release()
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                logger.error("Post-processing of %s failed: %s", path, e)
+                self._discard_pool(pool)
+                return
+            except Exception as e:
+                logger.error("Post-processing of %s failed: %s", path, e)
+                return
+            result["preview_url"] = self.url(preview_path)
+            result["thumbnail_url"] = self.url(thumbnail_path)
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error("Cannot publish post-processing of %s: %s", path, e)
+
+        future.add_done_callback(done)
+        return True
+
+    def url(self, path):
+        rel_path = os.path.relpath(path, settings.PUB_DIR)
+        return settings.BASE_HTTP_URL + rel_path.replace(os.sep, "/")
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
@@ -0,0 +1,134 @@
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+
+from . import settings
+from .imaging import render_preview
+
+logger = logging.getLogger(__name__)
+
+
+class PreviewCache:
+    """
+    Resized JPEG previews of frames, rendered on demand.
+
+    Rendered previews are kept in a size bounded LRU in memory and in
+    another one on disk. Concurrent requests for the same preview wait
+    for a single render.
+    """
+
+    def __init__(self, directory=None, memory_size=None, disk_size=None):
+        self.directory = directory or settings.PREVIEW_CACHE_DIR
+        self.memory_size = memory_size or settings.PREVIEW_CACHE_MEMORY
+        self.disk_size = disk_size or settings.PREVIEW_CACHE_DISK
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.memory_used = 0
+        self.disk = None
+        self.disk_used = 0
+        self.rendering = {}
+
+    def get(self, path, size):
+        stat = os.stat(path)
+        key = hashlib.sha1(
+            f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{size}".encode()
+        ).hexdigest()
+
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+
+            future = self.rendering.get(key)
+            owner = future is None
+            if owner:
+                future = self.rendering[key] = concurrent.futures.Future()
+
+        if owner:
+            try:
+                data = self._load(key)
+                if data is None:
+                    data = render_preview(path, size)
+                    self._store(key, data)
+                self._remember(key, data)
+                future.set_result(data)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.rendering[key]
+
+        return future.result()
+
+    def _remember(self, key, data):
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = data
+            self.memory_used += len(data)
+            while self.memory_used > self.memory_size and self.memory:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted)
+
+    def _file(self, key):
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def _scan_disk(self):
+        # called with the lock held, oldest used first
+        self.disk = collections.OrderedDict()
+        self.disk_used = 0
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jpg"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[: -len(".jpg")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_used += size
+
+    def _load(self, key):
+        with self.lock:
+            if self.disk is None:
+                self._scan_disk()
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+            os.utime(self._file(key))
+            return data
+        except OSError:
+            return None
+
+    def _store(self, key, data):
+        try:
+            with open(self._file(key) + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(self._file(key) + ".tmp", self._file(key))
+        except OSError as e:
+            logger.warning("Cannot store preview in %s: %s", self.directory, e)
+            return
+
+        evicted = []
+        with self.lock:
+            self.disk[key] = len(data)
+            self.disk_used += len(data)
+            while self.disk_used > self.disk_size and len(self.disk) > 1:
+                old_key, old_size = self.disk.popitem(last=False)
+                self.disk_used -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.unlink(self._file(old_key))
+            except OSError:
+                pass
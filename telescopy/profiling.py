@@ -0,0 +1,102 @@
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+from . import metrics, settings
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all threads every `interval` seconds and counts
+    them in folded form, "thread;outer (file:line);...;inner (file:line)",
+    as read by flamegraph.pl and speedscope.
+
+    One profile runs at a time, stop() ends it early.
+    """
+
+    lock = threading.Lock()
+    running = None
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    @classmethod
+    def profile(cls, seconds, interval):
+        profiler = cls(interval)
+        with cls.lock:
+            if cls.running is not None:
+                raise ProfilerBusy("A profile is running already")
+            cls.running = profiler
+        try:
+            profiler.run(seconds)
+        finally:
+            with cls.lock:
+                cls.running = None
+        return profiler
+
+    @classmethod
+    def stop(cls):
+        with cls.lock:
+            if cls.running is None:
+                return False
+            cls.running.stopped.set()
+            return True
+
+    def run(self, seconds):
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    file_name = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({file_name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class Timing:
+    """
+    Switch of the @timed decorator, off it costs one attribute lookup.
+    """
+
+    enabled = settings.PROFILE_TIMING
+
+
+def timed(func):
+    """
+    Observes run times of `func` in the timing.<qualified name> histogram
+    while Timing is enabled.
+    """
+    name = f"timing.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not Timing.enabled:
+            return func(*args, **kwargs)
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.histogram(name).observe(time.monotonic() - start)
+
+    return wrapper
@@ -0,0 +1,80 @@
+import logging
+import os
+import shutil
+import threading
+
+from . import settings
+from .catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+
+class StorageFull(Exception):
+    pass
+
+
+class Retention:
+    """
+    Keeps published frames within STORAGE_QUOTA and at least STORAGE_MIN_FREE
+    bytes free on the PUB_DIR filesystem by evicting the oldest frames,
+    downloaded ones first.
+
+    Runs periodically in the background and before every exposure. The
+    size of published frames is the running total kept by the Catalog.
+    """
+
+    lock = threading.Lock()
+
+    @classmethod
+    def reserve(cls, frames=1):
+        """
+        Makes room for `frames` exposures, raises StorageFull when it can't.
+        """
+        if not cls.enforce(frames * settings.STORAGE_FRAME_RESERVE):
+            raise StorageFull("Not enough storage space for the next exposure")
+
+    @classmethod
+    def shortfall(cls, required=0):
+        """
+        Returns how many bytes have to be freed to store `required` more.
+        """
+        free = shutil.disk_usage(settings.PUB_DIR).free
+        shortfall = settings.STORAGE_MIN_FREE + required - free
+        if settings.STORAGE_QUOTA:
+            quota_shortfall = Catalog.total_size + required - settings.STORAGE_QUOTA
+            shortfall = max(shortfall, quota_shortfall)
+        return shortfall
+
+    @classmethod
+    def enforce(cls, required=0):
+        """
+        Evicts frames until `required` bytes fit, returns False when
+        there was nothing left to evict.
+        """
+        with cls.lock:
+            shortfall = cls.shortfall(required)
+            if shortfall <= 0:
+                return True
+
+            candidates = Catalog.oldest(downloaded=True)
+            if settings.STORAGE_EVICT_NOT_DOWNLOADED:
+                candidates += Catalog.oldest(downloaded=False)
+
+            evicted = 0
+            freed = 0
+            for entry in candidates:
+                if freed >= shortfall:
+                    break
+                try:
+                    if Catalog.delete(os.path.join(settings.PUB_DIR, entry["path"])):
+                        evicted += 1
+                        freed += entry["size"]
+                except OSError as e:
+                    logger.warning("Cannot evict %s: %s", entry["path"], e)
+
+            if evicted:
+                logger.info("Evicted %d frames, %d bytes", evicted, freed)
+            if freed < shortfall:
+                logger.warning("Storage is short of %d bytes", shortfall - freed)
+                return False
+            return True
@@ -0,0 +1,264 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+
+from . import metrics, settings
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime:
+    """
+    Runs background jobs of drivers and servers.
+
+    With RUNTIME = "threads" every job gets a thread of its own. With
+    RUNTIME = "asyncio" periodic jobs and socket readers are tasks on one
+    event loop, run by the main thread, and blocking calls (gphoto,
+    requests) share an executor of RUNTIME_WORKERS threads.
+
+    Jobs return concurrent.futures.Future in both modes. @non_blocking
+    handlers run in a DeviceExecutor of their device in both modes.
+    """
+
+    loop = None
+    executor = None
+    device_executors = {}
+    device_executors_lock = threading.Lock()
+
+    @classmethod
+    def start(cls):
+        if settings.RUNTIME == "asyncio" and cls.loop is None:
+            cls.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=settings.RUNTIME_WORKERS
+            )
+            cls.loop = asyncio.new_event_loop()
+            cls.loop.set_default_executor(cls.executor)
+            asyncio.set_event_loop(cls.loop)
+
+    @classmethod
+    def submit(cls, func, *args, **kwargs):
+        """
+        Runs a blocking call in the background.
+        """
+        if cls.executor is not None:
+            return cls.executor.submit(cls._call, func, *args, **kwargs)
+
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(cls._call(func, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    @classmethod
+    def every(cls, interval, func, condition=None):
+        """
+        Calls `func` every `interval` seconds for as long as `condition()`,
+        if given, is true.
+        """
+        if cls.loop is not None:
+            return asyncio.run_coroutine_threadsafe(
+                cls._every(interval, func, condition), cls.loop
+            )
+
+        def run():
+            while condition is None or condition():
+                try:
+                    cls._call(func)
+                except Exception:
+                    # logged already, the next call may succeed
+                    pass
+                time.sleep(interval)
+
+        return cls.submit(run)
+
+    @classmethod
+    def read(cls, sock, on_data, size=4096):
+        """
+        Calls `on_data` with data received from `sock` until the end of
+        the stream.
+        """
+        if cls.loop is not None:
+            cls.loop.call_soon_threadsafe(cls._add_reader, sock, on_data, size)
+            return
+
+        def run():
+            while True:
+                data = sock.recv(size)
+                if not data:
+                    return
+                cls._call(on_data, data)
+
+        cls.submit(run)
+
+    @classmethod
+    def device_executor(cls, device):
+        name = getattr(device, "name", type(device).__name__)
+        with cls.device_executors_lock:
+            if name not in cls.device_executors:
+                cls.device_executors[name] = DeviceExecutor(
+                    name, settings.DEVICE_WORKERS
+                )
+            return cls.device_executors[name]
+
+    @classmethod
+    def run_forever(cls):
+        cls.loop.run_forever()
+
+    @classmethod
+    def stop(cls):
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+
+    @classmethod
+    async def _every(cls, interval, func, condition):
+        while condition is None or condition():
+            try:
+                await cls.loop.run_in_executor(cls.executor, cls._call, func)
+            except Exception:
+                # logged already, the next call may succeed
+                pass
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def _add_reader(cls, sock, on_data, size):
+        fileno = sock.fileno()
+
+        def ready():
+            try:
+                data = sock.recv(size)
+            except OSError:
+                data = b""
+            if not data:
+                cls.loop.remove_reader(fileno)
+                return
+            cls._call(on_data, data)
+
+        cls.loop.add_reader(fileno, ready)
+
+    @classmethod
+    def _call(cls, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error("%s failed: %s", getattr(func, "__qualname__", func), e)
+            raise
+
+
+class DeviceExecutor:
+    """
+    Runs @non_blocking handlers of one device on at most `workers` threads,
+    started as they are needed.
+
+    A call of a superseding handler supersedes its calls made before: the
+    ones still queued are skipped and the running one sees superseded()
+    turn True, so it can give up.
+    """
+
+    DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+    class Job:
+        def __init__(self, handler, func, args, kwargs):
+            self.handler = handler
+            self.func = func
+            self.args = args
+            self.kwargs = kwargs
+            self.submitted = time.monotonic()
+            self.superseded = threading.Event()
+
+    local = threading.local()
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = 0
+        self.idle = 0
+        # latest job of each superseding handler
+        self.latest = {}
+
+    def submit(self, handler, func, args, kwargs, supersede=False):
+        job = self.Job(handler, func, args, kwargs)
+        with self.lock:
+            if supersede:
+                previous = self.latest.get(handler)
+                if previous is not None:
+                    previous.superseded.set()
+                self.latest[handler] = job
+            if self.idle == 0 and self.threads < self.workers:
+                self.threads += 1
+                threading.Thread(
+                    target=self._work,
+                    name=f"{self.name}-{self.threads}",
+                    daemon=True,
+                ).start()
+            self.jobs.put(job)
+        metrics.histogram(
+            f"handler.queue_depth.{self.name}", self.DEPTH_BUCKETS
+        ).observe(self.jobs.qsize())
+        return job
+
+    def _work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            job = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+            self._run(job)
+
+    def _run(self, job):
+        prefix = f"handler.{self.name}.{job.handler}"
+        if job.superseded.is_set():
+            metrics.histogram(f"{prefix}.superseded").observe(
+                time.monotonic() - job.submitted
+            )
+            return
+
+        started = time.monotonic()
+        metrics.histogram(f"{prefix}.wait").observe(started - job.submitted)
+        self.local.job = job
+        try:
+            Runtime._call(job.func, *job.args, **job.kwargs)
+        except Exception:
+            # logged already
+            pass
+        finally:
+            self.local.job = None
+            metrics.histogram(f"{prefix}.run").observe(time.monotonic() - started)
+            with self.lock:
+                if self.latest.get(job.handler) is job:
+                    del self.latest[job.handler]
+
+
+def superseded():
+    """
+    Tells a running @non_blocking handler it has been called again since.
+    """
+    job = getattr(DeviceExecutor.local, "job", None)
+    return job is not None and job.superseded.is_set()
+
+
+def non_blocking(func=None, supersede=False):
+    """
+    Makes a driver callback return at once and run in the executor of its
+    device. With `supersede` a new call supersedes the earlier ones.
+    """
+    if func is None:
+        return functools.partial(non_blocking, supersede=supersede)
+
+    @functools.wraps(func)
+    def wrapper(device, *args, **kwargs):
+        Runtime.device_executor(device).submit(
+            func.__name__, func, (device,) + args, kwargs, supersede=supersede
+        )
+
+    return wrapper
@@ -9,19 +9,95 @@ def _to_bool(v):
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 HTTP_PORT = 8000
+HTTP_MAX_CONNECTIONS = 16
+# seconds a connection waits for one of those before it is answered 503
+HTTP_QUEUE_TIMEOUT = 5
+HTTP_TIMEOUT = 30
+CATALOG_PAGE_SIZE = 100
+CATALOG_MAX_PAGE_SIZE = 1000
+# new frame records kept for clients resuming the event feed
+FEED_HISTORY = 1000
+# idle event feed connections get a comment this often
+FEED_HEARTBEAT = 15
+# event feed connections, on top of HTTP_MAX_CONNECTIONS
+FEED_MAX_SUBSCRIBERS = 4
 BASE_HTTP_URL = f"http://192.168.5.50:{HTTP_PORT}/"
 
 PUB_DIR = os.path.join(BASE_DIR, "pub")
+# must be on the same filesystem as PUB_DIR, frames are moved with a rename
+STAGING_DIR = os.path.join(PUB_DIR, ".staging")
 
-GPHOTO_PATH = "gphoto2"
+POSTPROCESS_WORKERS = 1
+POSTPROCESS_QUEUE_SIZE = 4
+PREVIEW_SIZE = 1024
+THUMBNAIL_SIZE = 256
+PREVIEW_MIN_SIZE = 16
+PREVIEW_MAX_SIZE = 2048
+PREVIEW_CACHE_DIR = os.path.join(PUB_DIR, ".cache", "previews")
+PREVIEW_CACHE_MEMORY = 16 * 1024 * 1024
+PREVIEW_CACHE_DISK = 256 * 1024 * 1024
+
+# bytes of published frames, 0 for no quota
+STORAGE_QUOTA = int(os.environ.get("STORAGE_QUOTA", 0))
+# free space on the PUB_DIR filesystem kept on top of the frame being taken
+STORAGE_MIN_FREE = int(os.environ.get("STORAGE_MIN_FREE", 512 * 1024 * 1024))
+# space one exposure (raw + jpeg) is expected to take
+STORAGE_FRAME_RESERVE = 64 * 1024 * 1024
+# when False only frames that were downloaded over HTTP are evicted
+STORAGE_EVICT_NOT_DOWNLOADED = _to_bool(
+    os.environ.get("STORAGE_EVICT_NOT_DOWNLOADED", False)
+)
+STORAGE_CHECK_INTERVAL = 60
+CATALOG_DOWNLOADS_FILE = os.path.join(PUB_DIR, ".cache", "downloaded")
+
+GPHOTO_PATH = os.environ.get("GPHOTO_PATH", "gphoto2")
+GPHOTO_TIMEOUT = 60
+GPHOTO_CONFIG_CACHE_TTL = 300
+GPHOTO_CACHE_DIR = os.path.join(PUB_DIR, ".cache", "gphoto")
 FOCUSER_IP = "192.168.5.51"
 
 # PHD2_IP = '192.168.5.21'
 PHD2_IP = "localhost"
 PHD2_PORT = 4400
 
+# updates of a property vector sent to clients a second at most,
+# by default and by vector name, see telescopy.throttle.PropertyThrottle
+PROPERTY_MAX_RATE = 0.5
+PROPERTY_MAX_RATES = {}
+
+# timing of driver callbacks, switched at runtime with POST /api/timing
+PROFILE_TIMING = _to_bool(os.environ.get("PROFILE_TIMING", False))
+PROFILE_INTERVAL = 0.01
+PROFILE_MAX_SECONDS = 300
+
+# "threads" or "asyncio", see telescopy.runtime.Runtime
+RUNTIME = os.environ.get("RUNTIME", "threads")
+# executor threads for blocking calls of the asyncio runtime
+RUNTIME_WORKERS = int(os.environ.get("RUNTIME_WORKERS", 8))
+# threads running @non_blocking handlers of each device
+DEVICE_WORKERS = 4
+
+# crashed services are restarted after a delay doubling up to the maximum
+SUPERVISOR_RESTART_DELAY = 1
+SUPERVISOR_MAX_RESTART_DELAY = 60
+# docker kills the container 10 s after SIGTERM
+SHUTDOWN_TIMEOUT = 8
+# each shutdown hook gets this much of it at most
+SHUTDOWN_HOOK_TIMEOUT = 3
+
+# drivers to load, names from telescopy.devices.DRIVERS
+DRIVERS = [
+    name.strip()
+    for name in os.environ.get("DRIVERS", "NodeFocuser,PHD2,SonySLTA58").split(",")
+    if name.strip()
+]
+
 ENABLE_SIMULATORS = _to_bool(os.environ.get("ENABLE_SIMULATORS", True))
 
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Loggers hand records to the "queue" handler, which passes them on to
+# handlers of the "telescopy.logs.sink" logger in a thread of its own.
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -39,6 +115,20 @@ LOGGING = {
             "class": "indi.logging.Handler",
             "router": None,
         },
+        "queue": {
+            "class": "telescopy.logs.QueueHandler",
+            "sink": "telescopy.logs.sink",
+            "rate": 10,
+            "burst": 50,
+            "sample": 100,
+            "limits": {},
+        },
+    },
+    "loggers": {
+        "": {"level": LOG_LEVEL, "handlers": ["queue"]},
+        "telescopy.logs.sink": {
+            "handlers": ["console", "indi"],
+            "propagate": False,
+        },
     },
-    "loggers": {"": {"level": logging.DEBUG, "handlers": ["console", "indi"],},},
 }
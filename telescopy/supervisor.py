@@ -0,0 +1,108 @@
+import logging
+import signal
+import threading
+import time
+
+from . import settings
+from .runtime import Runtime
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Runs long living services each in a thread of its own, restarting them
+    with a growing delay when they crash, and shuts the process down
+    gracefully on SIGTERM or SIGINT.
+
+    Shutdown hooks run in the order they were registered, each in a
+    thread of its own given SHUTDOWN_HOOK_TIMEOUT seconds, so a hook
+    that hangs does not keep the ones after it from running. All of
+    them are given SHUTDOWN_TIMEOUT seconds altogether.
+    """
+
+    stopping = threading.Event()
+    services = {}
+    hooks = []
+
+    @classmethod
+    def add(cls, name, target):
+        thread = threading.Thread(
+            target=cls._supervise, args=(name, target), name=name, daemon=True
+        )
+        cls.services[name] = thread
+        thread.start()
+
+    @classmethod
+    def on_shutdown(cls, hook):
+        cls.hooks.append(hook)
+
+    @classmethod
+    def run(cls):
+        """
+        Sleeps, or runs the asyncio runtime, until a termination signal
+        arrives, then shuts down.
+        """
+        if Runtime.loop is not None:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                Runtime.loop.add_signal_handler(signum, Runtime.stop)
+            Runtime.run_forever()
+        else:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, cls._signalled)
+            # lock waits are interrupted by signals, so this takes no CPU
+            cls.stopping.wait()
+        cls.shutdown()
+
+    @classmethod
+    def shutdown(cls):
+        logger.info("Shutting down")
+        cls.stopping.set()
+
+        deadline = time.monotonic() + settings.SHUTDOWN_TIMEOUT
+        for hook in cls.hooks:
+            timeout = min(settings.SHUTDOWN_HOOK_TIMEOUT, deadline - time.monotonic())
+            if timeout <= 0:
+                logger.warning("Shutdown timed out, skipping %s", hook)
+                continue
+            thread = threading.Thread(target=cls._run_hook, args=(hook,), daemon=True)
+            thread.start()
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning("Shutdown of %s timed out", hook)
+        logging.shutdown()
+
+    @classmethod
+    def _run_hook(cls, hook):
+        try:
+            hook()
+        except Exception as e:
+            logger.error("Shutdown of %s failed: %s", hook, e)
+
+    @classmethod
+    def _signalled(cls, signum, frame):
+        cls.stopping.set()
+
+    @classmethod
+    def _supervise(cls, name, target):
+        failures = 0
+        while not cls.stopping.is_set():
+            started = time.monotonic()
+            try:
+                target()
+                if not cls.stopping.is_set():
+                    logger.error("Service %s stopped", name)
+            except Exception as e:
+                logger.error("Service %s crashed: %s", name, e)
+            if cls.stopping.is_set():
+                return
+
+            if time.monotonic() - started > settings.SUPERVISOR_MAX_RESTART_DELAY:
+                failures = 0
+            delay = min(
+                settings.SUPERVISOR_RESTART_DELAY * 2 ** failures,
+                settings.SUPERVISOR_MAX_RESTART_DELAY,
+            )
+            failures += 1
+            logger.info("Restarting service %s in %s s", name, delay)
+            cls.stopping.wait(delay)
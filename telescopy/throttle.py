@@ -0,0 +1,63 @@
+import threading
+import time
+
+from . import settings
+
+
+class PropertyThrottle:
+    """
+    Publishes values of the elements of one property vector to clients,
+    dropping values equal to the last one published and sending at most
+    PROPERTY_MAX_RATE updates a second, or PROPERTY_MAX_RATES[name].
+
+    A value held back by the rate limit is published once the interval
+    passes, unless a newer one replaces it. flush() publishes it at once,
+    call it before ending a busy state so clients end up with the latest
+    value.
+    """
+
+    def __init__(self, name):
+        rate = settings.PROPERTY_MAX_RATES.get(name, settings.PROPERTY_MAX_RATE)
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        # id(element): last value published
+        self.published = {}
+        # id(element): (element, value) held back
+        self.pending = {}
+        self.last = None
+        self.timer = None
+
+    def set(self, element, value):
+        key = id(element)
+        with self.lock:
+            self.published.setdefault(key, element.value)
+            self.pending.pop(key, None)
+            if value == self.published[key]:
+                return
+            self.pending[key] = (element, value)
+
+            now = time.monotonic()
+            if self.last is None or now - self.last >= self.interval:
+                self._publish(now)
+            elif self.timer is None:
+                self.timer = threading.Timer(
+                    self.last + self.interval - now, self.flush
+                )
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._publish(time.monotonic())
+
+    def _publish(self, now):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        for key, (element, value) in self.pending.items():
+            element.value = value
+            self.published[key] = value
+        self.pending.clear()
+        self.last = now